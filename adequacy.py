@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+# --- Vectorized Dialysis Adequacy (URR & Daugirdas second-generation Kt/V) ---
+# Works on scalars, NumPy arrays or pandas columns in one call. Rows that cannot
+# give a result (missing or non-positive urea, R <= 0.008 * t, bad weight) come
+# back masked instead of raising, so a month of sessions never stops on one
+# bad report.
+
+
+def to_numeric(values):
+    # "5.8*", "Not found", None -> 5.8, NaN, NaN
+    series = pd.Series(values, dtype="object").astype("string").str.replace("*", "", regex=False)
+    return pd.to_numeric(series, errors="coerce").to_numpy(dtype=float)
+
+
+def adequacy_arrays(urea, post_urea, dialysis_time, uf_volume, post_weight):
+    urea, post_urea, dialysis_time, uf_volume, post_weight = np.broadcast_arrays(
+        *(np.asarray(v, dtype=float) for v in (urea, post_urea, dialysis_time, uf_volume, post_weight))
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        R = post_urea / urea
+        log_arg = R - 0.008 * dialysis_time
+        kt_v = -np.log(log_arg) + (4 - 3.5 * R) * (uf_volume / post_weight)
+        URR = (1 - R) * 100
+
+    invalid = ~(np.isfinite(R) & (urea > 0) & (R > 0) & (log_arg > 0) & (post_weight > 0) & np.isfinite(kt_v))
+    return (
+        np.ma.masked_array(np.round(URR, 2), mask=invalid),
+        np.ma.masked_array(np.round(kt_v, 2), mask=invalid),
+    )
+
+
+def _column(df, value):
+    # Column name -> its values; anything else is broadcast as a constant
+    if isinstance(value, str):
+        column = df[value]
+        return column.to_numpy(dtype=float) if pd.api.types.is_numeric_dtype(column) else to_numeric(column)
+    return value
+
+
+def adequacy_frame(df, dialysis_time, uf_volume, post_weight, urea="Urea", post_urea="Urea - Post Dialysis"):
+    # Adds "URR (%)" and "KT/V" columns (NaN where masked); parameters may be column names or constants
+    URR, kt_v = adequacy_arrays(
+        _column(df, urea), _column(df, post_urea),
+        _column(df, dialysis_time), _column(df, uf_volume), _column(df, post_weight),
+    )
+    out = df.copy()
+    out["URR (%)"] = URR.filled(np.nan)
+    out["KT/V"] = kt_v.filled(np.nan)
+    return out
+
+
+# Single report, as shown in the app: a lab_results.LabTable in, (URR, Kt/V) of one report out
+def calculate_adequacy(results, dialysis_time, uf_volume, post_weight, report=0):
+    urea, post_urea = results.get("Urea", report), results.get("Urea - Post Dialysis", report)
+    if np.isnan(urea) or np.isnan(post_urea):
+        raise ValueError("Urea and post-dialysis urea are both needed")
+    URR, kt_v = adequacy_arrays(urea, post_urea, dialysis_time, uf_volume, post_weight)
+    if np.ma.is_masked(kt_v):
+        raise ValueError(f"Urea {urea:g} / post-dialysis urea {post_urea:g} do not give a valid result")
+    return float(URR), float(kt_v)
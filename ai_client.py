@@ -0,0 +1,258 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from metrics import registry, span
+
+# Tried in order when the discovered model fails or discovery finds nothing
+FALLBACK_MODELS = [
+    'gemini-1.5-flash',
+    'gemini-1.5-pro',
+    'gemini-pro',
+]
+
+
+def model_id(name):
+    # list_models() names are "models/gemini-1.5-flash"; the SDK accepts either form
+    return name[len("models/"):] if name.startswith("models/") else name
+
+
+# --- Model Resolution (cached, process-wide) ---
+# genai.list_models() is a network round trip, so the compatible model list and
+# the chosen model are cached for `ttl` seconds and shared by every session.
+# The cache refreshes on TTL expiry or when the chosen model reports an error.
+# Model names are kept without the "models/" prefix, so a discovered model and
+# the same fallback are one candidate.
+# The Gemini SDK (grpc and protobuf underneath, most of the app's import time)
+# is imported and configured on first use, not when the resolver is created.
+# Passing `sdk` (e.g. fake_gemini.FakeGemini) replaces it entirely.
+class ModelResolver:
+    def __init__(self, api_key=None, ttl=3600, error_ttl=30, fallback_models=FALLBACK_MODELS, sdk=None):
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.fallback_models = [model_id(name) for name in fallback_models]
+        self._api_key = api_key
+        self._sdk = sdk
+        self._sdk_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._available = []
+        self._chosen = None
+        self._error = None
+        self._expires_at = 0.0
+        self._loaded = False
+
+    @property
+    def sdk(self):
+        with self._sdk_lock:
+            if self._sdk is None:
+                with span("sdk_init"):
+                    import google.generativeai as genai
+                    if self._api_key:
+                        genai.configure(api_key=self._api_key)
+                self._sdk = genai
+            return self._sdk
+
+    @property
+    def loaded(self):
+        # True once discovery has run (successfully or not)
+        return self._loaded
+
+    def _discover(self):
+        available = []
+        sdk = self.sdk
+        with span("list_models"):
+            for model in sdk.list_models():
+                if 'generateContent' in model.supported_generation_methods:
+                    available.append(model_id(model.name))
+        return available
+
+    def _refresh_if_expired(self):
+        # Called with the lock held; only one thread hits the network per expiry
+        if time.monotonic() < self._expires_at:
+            return
+        self._loaded = True
+        try:
+            self._available = self._discover()
+            self._error = None
+            self._chosen = self._available[0] if self._available else None
+            self._expires_at = time.monotonic() + self.ttl
+        except Exception as e:
+            self._available = []
+            self._error = e
+            self._chosen = None
+            # Retry discovery sooner after a failure
+            self._expires_at = time.monotonic() + self.error_ttl
+
+    def available_models(self):
+        with self._lock:
+            self._refresh_if_expired()
+            return list(self._available)
+
+    @property
+    def last_error(self):
+        return self._error
+
+    def resolve(self):
+        with self._lock:
+            self._refresh_if_expired()
+            if self._chosen is None:
+                raise Exception("No compatible Gemini models found. Please check your API key is from aistudio.google.com")
+            return self._chosen
+
+    # Like resolve(), but returns None instead of raising when nothing is available
+    def current_model(self):
+        with self._lock:
+            self._refresh_if_expired()
+            return self._chosen
+
+    def report_success(self, model_name):
+        # A working fallback becomes the cached choice until the next refresh
+        with self._lock:
+            self._chosen = model_id(model_name)
+            self._expires_at = max(self._expires_at, time.monotonic() + self.ttl)
+
+    def report_failure(self, model_name):
+        with self._lock:
+            if model_id(model_name) == self._chosen:
+                self._chosen = None
+                self._expires_at = 0.0
+
+
+# --- Streaming generation with fallback ---
+def _chunk_texts(response, model_name=None):
+    usage = None
+    for chunk in response:
+        usage = getattr(chunk, "usage_metadata", None) or usage
+        try:
+            text = chunk.text
+        except ValueError:
+            # Chunks without text parts (e.g. safety metadata) carry nothing to show
+            continue
+        if text:
+            yield text
+    # The SDK reports cumulative token counts; the last chunk carries the totals
+    if usage is not None:
+        registry.increment("prompt_tokens_total", getattr(usage, "prompt_token_count", 0) or 0, model=model_name)
+        registry.increment("output_tokens_total", getattr(usage, "candidates_token_count", 0) or 0, model=model_name)
+
+
+def _model_not_found(error):
+    # Only a missing or retired model should drop the cached choice; a 429,
+    # timeout or server error says nothing about the model itself. The SDK's
+    # NotFound carries code 404 (an HTTPStatus).
+    return getattr(error, "code", None) == 404 or "not found" in str(error).lower()
+
+
+def _open_stream(sdk, model_name, prompt, timeout=None):
+    request_options = {"timeout": timeout} if timeout else None
+    with span("model_first_chunk", model=model_name):
+        response = sdk.GenerativeModel(model_name).generate_content(prompt, stream=True, request_options=request_options)
+        chunks = _chunk_texts(response, model_name)
+        # Connection and model errors surface on the first chunk
+        first = next(chunks, "")
+    return first, chunks
+
+
+# --- Hedged dispatch across models ---
+# The primary model starts first. If it has not produced its first chunk within
+# `hedge_after` seconds, or it fails, the next candidate is launched alongside
+# it; the first attempt to stream back wins and the others are cancelled (not
+# yet started) or closed as soon as they return, including attempts that only
+# connect after stream() has returned. Every attempt is bounded by
+# `attempt_timeout` and must be paid for through `charge(attempt_index)`, which
+# returns False when there is no quota for another attempt.
+class HedgedDispatcher:
+    def __init__(self, max_workers=8, hedge_after=6.0, attempt_timeout=60.0):
+        self.hedge_after = hedge_after
+        self.attempt_timeout = attempt_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini")
+
+    def _attempt(self, sdk, model_name, prompt, cancelled):
+        first, chunks = _open_stream(sdk, model_name, prompt, self.attempt_timeout)
+        if cancelled.is_set():
+            # Lost the race while connecting
+            chunks.close()
+        return first, chunks
+
+    @staticmethod
+    def _close_loser(future):
+        # Done callback for attempts still running when the race was decided
+        if not future.cancelled() and future.exception() is None:
+            future.result()[1].close()
+
+    def stream(self, resolver, prompt, charge=None):
+        started = time.perf_counter()
+        candidates = list(dict.fromkeys(m for m in [resolver.current_model()] + resolver.fallback_models if m))
+        cancelled = threading.Event()
+        pending = {}
+        errors = []
+
+        def launch():
+            index = len(pending) + len(errors)
+            if index >= len(candidates) or (charge and not charge(index)):
+                return False
+            future = self._executor.submit(self._attempt, resolver.sdk, candidates[index], prompt, cancelled)
+            pending[future] = (candidates[index], time.monotonic() + self.attempt_timeout)
+            registry.increment("model_attempts_total", model=candidates[index])
+            return True
+
+        launch()
+        winner = None
+        while pending and winner is None:
+            nearest_deadline = min(deadline for _, deadline in pending.values())
+            timeout = max(0.0, min(self.hedge_after, nearest_deadline - time.monotonic()))
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            failed = False
+            for future in done:
+                model_name, _ = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append((model_name, e))
+                    if model_name == candidates[0] and _model_not_found(e):
+                        resolver.report_failure(model_name)
+                    failed = True
+                    continue
+                if winner is None:
+                    winner = (model_name, result)
+                else:
+                    result[1].close()
+
+            now = time.monotonic()
+            for future, (model_name, deadline) in list(pending.items()):
+                if now >= deadline:
+                    del pending[future]
+                    # Still connecting in its thread; closed if it ever returns
+                    if not future.cancel():
+                        future.add_done_callback(self._close_loser)
+                    errors.append((model_name, TimeoutError(f"{model_name} timed out after {self.attempt_timeout}s")))
+                    failed = True
+
+            # Hedge on a failure, or when nothing answered within hedge_after
+            if winner is None and (failed or not done):
+                launch()
+
+        cancelled.set()
+        for future in pending:
+            # Runs at once if the attempt already finished, else when it does
+            if not future.cancel():
+                future.add_done_callback(self._close_loser)
+
+        if winner is None:
+            if not errors:
+                raise Exception("Rate limit reached before any model could be tried.")
+            _, first_error = errors[0]
+            raise Exception(f"Could not find working model. Original error: {first_error}")
+
+        model_name, (first, chunks) = winner
+        if model_name != candidates[0]:
+            resolver.report_success(model_name)
+        return self._relay(first, chunks, model_name, started)
+
+    @staticmethod
+    def _relay(first, chunks, model_name, started):
+        yield first
+        yield from chunks
+        # Whole call, from dispatch to the last chunk, as the user experiences it
+        registry.observe("model_call", time.perf_counter() - started, model=model_name)
+
@@ -0,0 +1,171 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from metrics import registry
+
+# Job states; the last four are final
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TIMED_OUT = "timed_out"
+FINAL_STATES = (DONE, FAILED, CANCELLED, TIMED_OUT)
+
+
+# --- One AI Request ---
+# Written by its worker thread, read by the session polling it. Streamed text
+# is appended chunk by chunk, so a poll can show the answer as it grows.
+class AIJob:
+    def __init__(self, session_id, kind, timeout, meta=None):
+        self.job_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.kind = kind
+        self.meta = meta or {}
+        self.status = QUEUED
+        self.error = None
+        self.parts = []
+        self.created = time.monotonic()
+        self.deadline = self.created + timeout
+        self.finished_at = None
+        self.cancel_requested = threading.Event()
+        self.future = None
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    @property
+    def finished(self):
+        return self.status in FINAL_STATES
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.monotonic()) - self.created
+
+
+# --- Background AI Job Executor (one per server process) ---
+# Analyses and follow-ups run on a bounded thread pool instead of the Streamlit
+# script thread; the session keeps only the job ID and polls for the result.
+# At most `max_in_flight` jobs talk to the model at once across all sessions,
+# the rest wait in the pool's queue. Cancellation and the per-job timeout are
+# checked while waiting for a slot and between streamed chunks; a stalled
+# connection is bounded by the dispatcher's own attempt timeout.
+class JobExecutor:
+    def __init__(self, max_workers=16, max_in_flight=4, default_timeout=120.0, result_ttl=600):
+        self.max_in_flight = max_in_flight
+        self.default_timeout = default_timeout
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ai-job")
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._jobs = {}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._next_prune = time.monotonic() + result_ttl
+
+    # stream_factory() returns an iterable of text chunks; on_complete(job) runs
+    # in the worker once the job is DONE (e.g. to fill the response cache)
+    def submit(self, session_id, kind, stream_factory, timeout=None, on_complete=None, meta=None):
+        job = AIJob(session_id, kind, timeout or self.default_timeout, meta)
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._next_prune:
+                self._prune(now)
+            self._jobs[job.job_id] = job
+        job.future = self._executor.submit(self._run, job, stream_factory, on_complete)
+        registry.increment("ai_jobs_submitted_total", kind=kind)
+        return job.job_id
+
+    def _prune(self, now):
+        # Amortised: forget finished jobs nobody collected within result_ttl
+        cutoff = now - self.result_ttl
+        for key in [k for k, j in self._jobs.items() if j.finished and j.finished_at < cutoff]:
+            del self._jobs[key]
+        self._next_prune = now + self.result_ttl
+
+    def _finish(self, job, status, error=None):
+        job.error = error
+        job.finished_at = time.monotonic()
+        job.status = status
+        registry.observe("ai_job", job.elapsed, kind=job.kind, status=status)
+
+    def _wait_for_slot(self, job):
+        while not job.cancel_requested.is_set():
+            remaining = job.deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self._slots.acquire(timeout=min(remaining, 0.25)):
+                return True
+        return False
+
+    def _run(self, job, stream_factory, on_complete):
+        if not self._wait_for_slot(job):
+            if job.cancel_requested.is_set():
+                self._finish(job, CANCELLED)
+            else:
+                self._finish(job, TIMED_OUT, "Timed out waiting for a free model slot")
+            return
+        with self._lock:
+            self._in_flight += 1
+        job.status = RUNNING
+        try:
+            chunks = iter(stream_factory())
+            try:
+                for chunk in chunks:
+                    job.parts.append(chunk)
+                    if job.cancel_requested.is_set():
+                        self._finish(job, CANCELLED)
+                        return
+                    if time.monotonic() > job.deadline:
+                        self._finish(job, TIMED_OUT, f"No complete answer within {int(job.deadline - job.created)} seconds")
+                        return
+            finally:
+                close = getattr(chunks, "close", None)
+                if close:
+                    close()
+            self._finish(job, DONE)
+        except Exception as e:
+            self._finish(job, FAILED, str(e))
+            return
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+        if on_complete:
+            on_complete(job)
+
+    # Jobs are only visible to the session that submitted them
+    def get(self, job_id, session_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.session_id != session_id:
+            return None
+        return job
+
+    def cancel(self, job_id, session_id):
+        job = self.get(job_id, session_id)
+        if job is None or job.finished:
+            return False
+        job.cancel_requested.set()
+        if job.future.cancel():
+            # Never started: no worker will report it
+            self._finish(job, CANCELLED)
+        return True
+
+    def discard(self, job_id, session_id):
+        # Drops a collected job so its text is not held until the TTL prune
+        if self.get(job_id, session_id) is not None:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+            in_flight = self._in_flight
+        return {
+            "queued": sum(1 for j in jobs if j.status == QUEUED),
+            "running": in_flight,
+            "finished": sum(1 for j in jobs if j.finished),
+            "max_in_flight": self.max_in_flight,
+        }
@@ -1,56 +1,64 @@
 import streamlit as st
-import fitz  
-import pandas as pd
-import re
-import math
-import google.generativeai as genai
-from datetime import datetime, timedelta
-from collections import deque
-
-# --- Rate Limiter Class ---
-class RateLimiter:
-    def __init__(self, max_requests=15, time_window=60):
-        if 'request_times' not in st.session_state:
-            st.session_state.request_times = deque()
-        self.max_requests = max_requests
-        self.time_window = time_window
-    
-    def can_make_request(self):
-        now = datetime.now()
-        while st.session_state.request_times and \
-              (now - st.session_state.request_times[0]).total_seconds() > self.time_window:
-            st.session_state.request_times.popleft()
-        return len(st.session_state.request_times) < self.max_requests
-    
-    def add_request(self):
-        st.session_state.request_times.append(datetime.now())
-    
-    def get_wait_time(self):
-        if len(st.session_state.request_times) < self.max_requests:
-            return 0
-        oldest_request = st.session_state.request_times[0]
-        elapsed = (datetime.now() - oldest_request).total_seconds()
-        return max(0, self.time_window - elapsed)
-    
-    def get_remaining_requests(self):
-        now = datetime.now()
-        while st.session_state.request_times and \
-              (now - st.session_state.request_times[0]).total_seconds() > self.time_window:
-            st.session_state.request_times.popleft()
-        return self.max_requests - len(st.session_state.request_times)
-
-# Initialize rate limiter (15 requests per minute)
-rate_limiter = RateLimiter(max_requests=15, time_window=60)
+import hashlib
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from streamlit.errors import StreamlitAPIException
+from lab_parser import PARSER_VERSION, ReportSnapshot, items_info, parse_report, extract_lab_results_layout
+from ai_client import ModelResolver, HedgedDispatcher
+from fake_gemini import FakeGemini
+from ai_jobs import DONE, QUEUED, JobExecutor
+from response_cache import ResponseCache
+from rate_limiter import GlobalRateLimiter, RateLimiter
+from result_store import ResultStore
+from prompt_builder import ConversationMemory, build_analysis_prompt, build_context, estimate_tokens
+from metrics import registry, span
+from session_memory import SessionArtifacts, approx_size, load_archive, process_rss, trim_chat_history
+# pandas/NumPy (tables, KT/V, comparison) and the Gemini SDK are not imported
+# here: the sections that need them import them on first use, so the first
+# paint only pays for Streamlit and the parser. See startup_profile.py.
+
+# --- Rate Limiter (one token bucket per server process, fair share per session) ---
+@st.cache_resource
+def get_global_rate_limiter():
+    return GlobalRateLimiter(max_requests=15, time_window=60)
+
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+rate_limiter = RateLimiter(get_global_rate_limiter(), st.session_state.session_id)
+
+# --- Session artifacts (parsed reports, upload sources; evicted when idle 30 min) ---
+@st.cache_resource
+def get_session_artifacts():
+    return SessionArtifacts(idle_ttl=1800)
+
+artifacts = get_session_artifacts()
+artifacts.touch(st.session_state.session_id)
+
+# Requests that would wait at most this long are queued instead of rejected
+RATE_LIMIT_QUEUE_SECONDS = 10
 
 # --- UI 样式 ---
-st.markdown("""
+# APP_BACKGROUND_URL="" skips the background image (a large download on every
+# new session), e.g. on autoscaled containers where first paint matters
+BACKGROUND_URL = os.environ.get("APP_BACKGROUND_URL", "https://github.com/USAGI7878/Blood-report_kt-v/raw/main/background%20ver%202.png")
+if BACKGROUND_URL:
+    st.markdown(f"""
     <style>
-        .stApp {
-            background-image: url("https://github.com/USAGI7878/Blood-report_kt-v/raw/main/background%20ver%202.png");
+        .stApp {{
+            background-image: url("{BACKGROUND_URL}");
             background-size: cover;
             background-position: center;
             background-attachment: fixed;
-        }
+        }}
+    </style>
+""", unsafe_allow_html=True)
+
+st.markdown("""
+    <style>
         .block-container {
             background-color: rgba(20, 20, 20, 0.85);
             border-radius: 15px;
@@ -98,89 +106,214 @@ st.markdown("""
 st.title("🧪 AI-Powered Blood Report Analyzer")
 st.caption("Powered by Google Gemini")
 
+# AI_BACKEND=stub swaps the Gemini SDK for a local stand-in (no key or network
+# needed), configured by AI_STUB, e.g. "latency=lognormal:1.5,0.5 rate_limit_rate=0.05"
+AI_BACKEND = os.environ.get("AI_BACKEND", "gemini")
+
+# --- Gemini model resolver (one per server process) ---
+@st.cache_resource
+def get_model_resolver():
+    if AI_BACKEND == "stub":
+        return ModelResolver(ttl=3600, sdk=FakeGemini.from_spec(os.environ.get("AI_STUB", "")))
+    return ModelResolver(api_key=st.secrets["GOOGLE_API_KEY"], ttl=3600)
+
+# --- Hedged Gemini dispatcher (shared thread pool) ---
+@st.cache_resource
+def get_ai_dispatcher():
+    return HedgedDispatcher(max_workers=8, hedge_after=6.0, attempt_timeout=60.0)
+
+# --- Background AI jobs (shared pool, at most 4 model calls in flight) ---
+@st.cache_resource
+def get_job_executor():
+    return JobExecutor(max_workers=16, max_in_flight=4, default_timeout=120.0)
+
+# --- AI response cache (memory LRU + SQLite, shared across sessions) ---
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache()
+
 # --- Load API Key from Secrets (Secure Method) ---
+# The SDK is only imported and configured when the resolver first lists or calls a model
 try:
-    api_key = st.secrets["GOOGLE_API_KEY"]
-    genai.configure(api_key=api_key)
+    if AI_BACKEND != "stub" and not st.secrets["GOOGLE_API_KEY"]:
+        raise KeyError("GOOGLE_API_KEY is empty")
     ai_enabled = True
     
     with st.expander("🔍 DEBUG: Available AI Models", expanded=False):
-        try:
-            available_models = []
-            for model in genai.list_models():
-                if 'generateContent' in model.supported_generation_methods:
-                    available_models.append(model.name)
-            
-            if available_models:
+        model_resolver = get_model_resolver()
+        if model_resolver.loaded or st.button("🔄 List available models"):
+            available_models = model_resolver.available_models()
+            if model_resolver.last_error:
+                st.error(f"❌ Error listing models: {model_resolver.last_error}")
+            elif available_models:
                 st.success(f"✅ Found {len(available_models)} compatible models:")
                 for model_name in available_models:
                     st.code(model_name)
             else:
                 st.error("❌ No compatible models found!")
                 st.info("This means your API key might not have access to Gemini models.")
-        except Exception as e:
-            st.error(f"❌ Error listing models: {e}")
+            st.caption(f"Model list cached for {model_resolver.ttl // 60} minutes, shared across sessions")
+        else:
+            st.caption("Models are discovered on the first AI request, or on demand here.")
             
 except Exception as e:
     ai_enabled = False
     st.warning(f"⚠️ AI features disabled. Error: {e}")
 
-# --- Extract Patient Info from PDF ---
-def extract_patient_info(text):
-    info = {"age": 0, "name": "", "id": ""}
-    
-    age_patterns = [
-        r"Age[:\s]+(\d{1,3})",
-        r"Age[:\s]+(\d{1,3})\s*(?:years|yrs|y)",
-        r"(\d{1,3})\s*(?:years old|yrs old|y/o)",
-        r"DOB.*?Age[:\s]+(\d{1,3})",
-    ]
-    for pattern in age_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            age = int(match.group(1))
-            if 0 < age < 120:
-                info["age"] = age
-                break
-    
-    name_patterns = [
-        r"Patient Name[:\s]+([A-Z][a-zA-Z\s]+?)(?:\n|(?:Age|DOB|ID|MRN))",
-        r"Name[:\s]+([A-Z][a-zA-Z\s]+?)(?:\n|(?:Age|DOB|ID|MRN))",
-    ]
-    for pattern in name_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            info["name"] = match.group(1).strip()
-            break
-    
-    id_patterns = [
-        r"(?:Patient ID|MRN|Medical Record)[:\s]+([A-Z0-9-]+)",
-        r"ID[:\s]+([A-Z0-9-]+)",
-    ]
-    for pattern in id_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            info["id"] = match.group(1).strip()
-            break
-    
-    return info
+# --- Cached PDF Parsing ---
+# Keyed by content hash + parser version and shared across sessions, so widget
+# changes reuse the parsed report instead of re-reading the PDF. The PDF bytes
+# are excluded from Streamlit's argument hashing
+# (leading underscore). Entries expire after an hour. With no source the call
+# only looks the report up: a miss raises KeyError, which is not cached.
+# `_parsed` stores a report parsed elsewhere (the process pool) under its key.
+@st.cache_data(max_entries=64, ttl=3600, show_spinner=False)
+def parse_report_cached(file_digest, parser_version, _source, _parsed=None):
+    if _parsed is not None:
+        return _parsed
+    if _source is None:
+        raise KeyError(file_digest)
+    return parse_report(_source)
+
+@st.cache_data(max_entries=64, ttl=3600, show_spinner=False)
+def parse_layout_cached(file_digest, parser_version, _source):
+    return extract_lab_results_layout(_source)
+
+def read_upload(uploaded_file):
+    # The uploader already holds the file in memory; getvalue() returns that
+    # buffer without another copy
+    data = uploaded_file.getvalue()
+    return data, hashlib.sha256(data).hexdigest()
+
+def upload_sources(files):
+    # [(bytes, sha256)] per uploaded file, hashed once per upload; sources of
+    # files no longer in the uploader are dropped
+    sources = artifacts.get(st.session_state.session_id, "sources") or {}
+    with span("upload_read"):
+        sources = {f.file_id: sources.get(f.file_id) or read_upload(f) for f in files}
+    artifacts.put(st.session_state.session_id, "sources", sources)
+    return [sources[f.file_id] for f in files]
+
+# --- Parallel parsing for multi-report comparison (one pool per server process) ---
+# Spawned, not forked: a fork would copy the server's threads and locks mid-use
+@st.cache_resource
+def get_parse_pool():
+    return ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1), mp_context=multiprocessing.get_context("spawn"))
+
+def parse_uploads(files):
+    # [(file, snapshot or error text)] in upload order. Snapshots are kept per
+    # session by content hash, so reruns only parse newly added files; files
+    # another session (or the single-report view) parsed come from the parse
+    # cache, and only the rest go to the pool
+    parsed = artifacts.get(st.session_state.session_id, "compare_reports") or {}
+    artifacts.put(st.session_state.session_id, "compare_reports", parsed)
+    sources = upload_sources(files)
+    digests = [digest for _, digest in sources]
+    missing = {}
+    for source, digest in sources:
+        if digest in parsed or digest in missing:
+            continue
+        try:
+            parsed[digest] = ReportSnapshot.from_parsed(digest, parse_report_cached(digest, PARSER_VERSION, None))
+        except KeyError:
+            missing[digest] = source
+    if len(missing) == 1:
+        (digest, data), = missing.items()
+        try:
+            parsed[digest] = ReportSnapshot.from_parsed(digest, parse_report_cached(digest, PARSER_VERSION, data))
+        except Exception as e:
+            parsed[digest] = f"Cannot read PDF: {e}"
+    elif missing:
+        with span("parse_reports_parallel"):
+            futures = {digest: get_parse_pool().submit(parse_report, data) for digest, data in missing.items()}
+            for digest, future in futures.items():
+                try:
+                    result = future.result()
+                    parse_report_cached(digest, PARSER_VERSION, None, result)
+                    parsed[digest] = ReportSnapshot.from_parsed(digest, result)
+                except Exception as e:
+                    parsed[digest] = f"Cannot read PDF: {e}"
+    for digest in set(parsed) - set(digests):
+        del parsed[digest]
+    return [(f, parsed[digest]) for f, digest in zip(files, digests)]
+
+# --- 读取上传的报告 (before any widget is drawn) ---
+# The uploaders and the compare toggle are keyed, so on the run after an
+# upload their values are already in session_state. The report is parsed here,
+# before the sidebar, and a newly uploaded report seeds the age / sex inputs,
+# so its results are flagged against its own patient's ranges on the first
+# render, not the previous patient's.
+compare_mode = st.session_state.get("compare_mode", False)
+uploads = []
+uploaded_file = None
+report = None
+source = file_digest = None
+if compare_mode:
+    if st.session_state.get("compare_uploads"):
+        from report_compare import sort_reports
+        uploads = parse_uploads(st.session_state.compare_uploads)
+        readable = [(f, parsed) for f, parsed in uploads if not isinstance(parsed, str)]
+        if readable:
+            compare_reports, compare_names = sort_reports([p for _, p in readable], [f.name for f, _ in readable])
+            # The latest report feeds patient info, KT/V, history and the AI panel below
+            report = compare_reports[-1]
+            uploaded_file = next(f for f, p in readable if p is report)
+            source, file_digest = artifacts.get(st.session_state.session_id, "sources")[uploaded_file.file_id]
+            artifacts.put(st.session_state.session_id, "report", report)
+else:
+    uploaded_file = st.session_state.get("single_upload")
+    if uploaded_file is not None:
+        source, file_digest = upload_sources([uploaded_file])[0]
+        # Parsed once per file and kept as this session's read-only snapshot, so
+        # reruns and the AI fragments reuse it instead of copying the cached parse
+        report = artifacts.get(st.session_state.session_id, "report")
+        if report is None or report.file_digest != file_digest:
+            # Stage spans inside only run on a parse cache miss
+            with span("parse_report"):
+                report = ReportSnapshot.from_parsed(file_digest, parse_report_cached(file_digest, PARSER_VERSION, source))
+            artifacts.put(st.session_state.session_id, "report", report)
+
+if 'patient_info' not in st.session_state:
+    st.session_state.patient_info = {"age": 0, "sex": "", "name": "", "id": ""}
+if report is not None and st.session_state.get("patient_info_from") != report.file_digest:
+    # Only a new report overwrites the inputs; edits to them stick across reruns
+    st.session_state.patient_info_from = report.file_digest
+    st.session_state.patient_info = dict(report.patient_info)
+    st.session_state.patient_age = report.patient_info["age"]
+    st.session_state.patient_sex = report.patient_info.get("sex", "")
+    st.session_state.patient_id = report.patient_info.get("id", "")
 
 # --- Sidebar for Patient Context ---
 with st.sidebar:
     st.header("⚙️ Patient Context (Optional)")
     
-    if 'patient_info' not in st.session_state:
-        st.session_state.patient_info = {"age": 0, "name": "", "id": ""}
-    
-    patient_age = st.number_input("Patient Age", min_value=0, max_value=120, value=st.session_state.patient_info["age"], help="Auto-extracted from PDF or enter manually")
+    patient_age = st.number_input("Patient Age", min_value=0, max_value=120, key="patient_age", help="Auto-extracted from PDF or enter manually")
+    sex_options = {"": "Not specified", "M": "Male", "F": "Female"}
+    patient_sex = st.selectbox("Patient Sex", list(sex_options), key="patient_sex", format_func=sex_options.get, help="Auto-extracted from PDF; selects sex-specific reference ranges")
     patient_conditions = st.text_area("Known Conditions", placeholder="e.g., Diabetes, Hypertension, CKD Stage 5", help="Enter any known medical conditions")
     current_medications = st.text_area("Current Medications", placeholder="e.g., Insulin, Lisinopril, EPO", help="List current medications")
     
     st.markdown("---")
     st.header("📊 API Usage")
     remaining = rate_limiter.get_remaining_requests()
-    st.metric("Requests Remaining", f"{remaining}/15")
-    st.caption("Resets every minute")
+    st.metric("Requests Remaining", f"{remaining}/{rate_limiter.max_requests}")
+    limiter_stats = get_global_rate_limiter().stats()
+    st.caption(f"Refills continuously · shared key: {limiter_stats['global_available']}/{get_global_rate_limiter().max_requests} left across {limiter_stats['active_sessions']} active session(s)")
+    if ai_enabled:
+        cache_stats = get_response_cache().stats()
+        cache_hits = cache_stats["memory_hits"] + cache_stats["disk_hits"]
+        st.caption(f"💾 AI cache: {cache_hits} hits / {cache_stats['misses']} misses ({cache_stats['disk_entries']} stored)")
+        job_stats = get_job_executor().stats()
+        st.caption(f"⚙️ AI jobs: {job_stats['running']}/{job_stats['max_in_flight']} running, {job_stats['queued']} queued")
+    chat_state = [st.session_state.get(key) for key in ("chat_history", "chat_archive", "context")]
+    session_bytes = artifacts.session_bytes(st.session_state.session_id) + approx_size(chat_state)
+    artifact_stats = artifacts.stats()
+    rss = process_rss()
+    st.caption(
+        f"🧠 Memory: this session ~{session_bytes / 1024:.0f} KB"
+        + (f" · server {rss / 2**20:.0f} MB" if rss else "")
+        + f" · {artifact_stats['artifact_bytes'] / 2**20:.1f} MB held for {artifact_stats['sessions']} session(s), {artifact_stats['evicted']} idle evicted"
+    )
     
     if ai_enabled:
         st.success("✅ AI Analysis Enabled")
@@ -188,57 +321,8 @@ with st.sidebar:
         st.info("💡 Get free API key from: https://aistudio.google.com/app/apikey")
 
 raw_text = ""
-results = []
-
-# --- 检查项目 ---
-items_info = {
-    "Creatinine": ("µmol/L", 44, 110),
-    "Uric Acid":("µmol/L", 120, 420),
-    "Urea": ("mmol/L", 3.0, 9.0),
-    "Potassium": ("mmol/L", 3.5, 5.1),
-    "Sodium": ("mmol/L", 135, 145),
-    "Albumin": ("g/L", 35, 50),
-    "Bilirubin": ("µmol/L", None, None),
-    "Calcium": ("mmol/L", 2.10, 2.55),
-    "Corrected Calcium": ("mmol/L", 2.10, 2.55),
-    "Phosphate": ("mmol/L", 0.65, 1.45),
-    "Alkaline Phosphatase": ("U/L", 40, 130),
-    "AST": ("U/L", None, None),
-    "ALT": ("U/L", None, None),
-    "Haemoglobin": ("g/dL", 120, 150),
-    "White Cell Count": ("µl", None, None),
-    "Hypochromic cells": ("%", None, None),
-    "Platelets": ("10^9/L", 150, 410),
-    "Glucose": ("mmol/L", 3.9, 7.7),
-    "Total Protein": ("g/L", None, None),
-    "HbA1C": ("%", None, None),
-    "Serum Iron": ("µmol/L", 9.0, 26.0),
-    "Sr. UIBC": ("µmol/L", None, None),
-    "Total Iron Binding Capacity": ("µmol/L", None, None),
-    "Saturation": ("%", 13, 51),
-    "Ferritin": ("µg/L", None, None),
-    "Total Chol": ("mmol/L", None, None),
-    "Triglyceride": ("mmol/L", None, None),
-    "LDL-C L": ("mmol/L", None, None),
-    "HDL-C": ("mmol/L", None, None),
-    "Intact Parathyroid Hormone": ("pg/mL", 1.6, 6.9),
-    "Lymphocytes": ("HSD/CU mm", 1.0, 4.0),
-    "Urea - Post Dialysis": ("mmol/L", 3.0, 9.0),
-    "GGT": ("U/L", None, None),
-}
-
-aliases = {
-    "Urea": ["Blood Urea", "Urea (BUN)"],
-    "Urea - Post Dialysis": ["Postdialysis Urea", "Post BUN"],
-    "Sr. Creatinine": ["Creatinine", "Serum Creatinine"],
-    "ALT": ["谷草转氨基酶", "ALT/SGPT (U/L)","A L T"],
-    "AST": ["谷丙转氨基酶", "AST/SGOT (U/L)","A S T"],
-}
-
-reverse_alias = {}
-for key, alist in aliases.items():
-    for alias in alist:
-        reverse_alias.setdefault(alias, []).append(key)
+results = None
+sero_results = None
 
 # --- ✅ Dialysis Parameters (moved above file uploader) ---
 st.subheader("⏱️ Dialysis Parameters")
@@ -253,24 +337,42 @@ with col3:
 st.markdown("---")
 
 # --- 上传 PDF ---
-uploaded_file = st.file_uploader("Upload a Lab Report PDF", type="pdf")
-
-if uploaded_file is not None:
-    file_bytes = uploaded_file.read()
-    raw_text = ""
-    page_count = 0
-
-    with fitz.open(stream=file_bytes, filetype="pdf") as doc:
-        page_count = doc.page_count
-        for i, page in enumerate(doc):
-            text = page.get_text("text").strip()
-            if text:
-                raw_text += text.replace("\n", " ")
-        
+ABNORMAL_CELL_STYLE = "background-color: rgba(140, 40, 40, 0.6)"
+st.toggle("📚 Compare several reports", key="compare_mode", help="Upload several PDFs (e.g. this month and last month) to see them side by side")
+if compare_mode:
+    st.file_uploader("Upload Lab Report PDFs", type="pdf", accept_multiple_files=True, key="compare_uploads")
+    for f, parsed in uploads:
+        if isinstance(parsed, str):
+            st.error(f"❌ {f.name}: {parsed}")
+    if report is not None:
+        from report_compare import comparison_table, report_labels, serology_table
+        labels = report_labels(compare_reports, compare_names)
+        st.subheader("📊 Report Comparison")
+        table, abnormal = comparison_table(compare_reports, labels, dialysis_time, uf_volume, post_weight, age=patient_age, sex=patient_sex)
+        st.dataframe(table.style.apply(lambda _: abnormal.map(lambda flag: ABNORMAL_CELL_STYLE if flag else ""), axis=None).format(precision=2, na_rep="-"))
+        st.caption("Values are in the units of the single-report table. Out-of-range values are highlighted; Δ is the latest report minus the previous one. The most recent report is shown in detail below.")
+        st.table(serology_table(compare_reports, labels))
+else:
+    st.file_uploader("Upload a Lab Report PDF", type="pdf", key="single_upload")
+debug_expander = None
+
+if report is not None:
+    # First report of the session pays for pandas/NumPy here, not at startup
+    import numpy as np
+    import pandas as pd
+    from adequacy import calculate_adequacy
+    from lab_results import lab_table
+    raw_text = report.raw_text
+    page_count = report.page_count
+    sero_results = report.serology
+    if raw_text:
+        # Units converted and flags set against this patient's age / sex ranges
+        with span("lab_table"):
+            results = lab_table([report.results], patient_age, patient_sex)
+
     st.success(f"✅ PDF processed successfully ({page_count} page{'s' if page_count > 1 else ''})")
     
-    patient_info = extract_patient_info(raw_text)
-    st.session_state.patient_info = patient_info
+    patient_info = report.patient_info
     
     if patient_info["age"] > 0 or patient_info["name"] or patient_info["id"]:
         with st.expander("👤 Auto-Extracted Patient Information", expanded=True):
@@ -285,98 +387,268 @@ if uploaded_file is not None:
                 if patient_info["id"]:
                     st.metric("Patient ID", patient_info["id"])
 
-    with st.expander("🐛 Debug Information", expanded=False):
+    debug_expander = st.expander("🐛 Debug Information", expanded=False)
+    with debug_expander:
         st.caption("📄 Page Extraction Details")
-        for i in range(page_count):
+        for i in range(report.pages_read):
             st.text(f"✓ Page {i+1} extracted")
+        if report.pages_read < page_count:
+            st.text(f"⏭️ Pages {report.pages_read + 1}-{page_count} skipped (all markers and serology already found)")
         
         st.caption("📜 Raw Text Preview")
         st.text_area("Extracted Text", raw_text[:3000], height=200)
 
 # --- 分析数据 ---
 if raw_text:
-    for item, (unit, low, high) in items_info.items():
-        patterns = [item] + reverse_alias.get(item, [])
-        value_found = False
-        for pattern in patterns:
-            match = re.search(rf"{pattern}\D*([\d.]+)", raw_text, re.IGNORECASE)
-            if match:
-                try:
-                    value = float(match.group(1))
-                    mark = "*" if (low and value < low) or (high and value > high) else ""
-                    ref = f"{low}-{high}" if low and high else "-"
-                    results.append([item, f"{value}{mark}", ref])
-                except:
-                    results.append([item, "⚠️ Failed to parse", "-"])
-                value_found = True
-                break
-        if not value_found:
-            results.append([item, "Not found", "-"])
-
-    df = pd.DataFrame(results, columns=["Test", "Value", "Reference Range"])
+    df = results.frame()
     st.subheader("🧪 Lab Result Analysis")
-    st.dataframe(df)
-
-# --- Serology Data Extraction ---
-def interpret_result(text):
-    if any(word in text.lower() for word in ["not detected", "negative", "non reactive"]):
-        return "Negative"
-    elif any(word in text.lower() for word in ["detected", "positive", "reactive"]):
-        return "Positive"
-    else:
-        return "Not done"
-
-def extract_serology(text):
-    results = {}
-
-    hiv = re.search(r"HIV.*?(Not Detected|Detected|Negative|Positive|Reactive|Non Reactive)", text, re.IGNORECASE)
-    results["Anti HIV antibody"] = interpret_result(hiv.group(1)) if hiv else "Not done"
-
-    hbsag = re.search(r"Hepatitis B Surface antigen.*?(Not Detected|Detected|Negative|Positive)", text, re.IGNORECASE)
-    results["Hep B antigen (HBsAg)"] = interpret_result(hbsag.group(1)) if hbsag else "Not done"
-
-    hbsab = re.search(r"Hepatitis B Surface antibody.*?(\d+\.?\d*)\s*IU/L", text, re.IGNORECASE)
-    results["Hep B antibody (HBsAb)"] = f"Positive ({hbsab.group(1)} IU/L)" if hbsab else "Not done"
-
-    hcv = re.search(r"Hepatitis C antibody.*?(Not Detected|Detected|Negative|Positive)", text, re.IGNORECASE)
-    results["Anti HCV antibody"] = interpret_result(hcv.group(1)) if hcv else "Not done"
-
-    results["Hep B Core antibody (HBcAb)"] = "Not done"
-
-    return results
+    flagged = df["Flag"] != ""
+    st.dataframe(df.style.apply(lambda _: np.where(flagged, ABNORMAL_CELL_STYLE, ""), subset="Value").format({"Value": "{:g}"}, na_rep="-"), hide_index=True)
+
+    if st.toggle("📐 Compare with layout-aware parser", help="Reads each table row by word position instead of the flattened text"):
+        layout_results = parse_layout_cached(file_digest, PARSER_VERSION, source)
+        both = lab_table([report.results, layout_results], patient_age, patient_sex)
+        text_values, layout_values = both.value
+        comparison = pd.DataFrame({
+            "Test": both.tests,
+            "Text Parser": text_values,
+            "Layout Parser": layout_values,
+        })
+        same = (text_values == layout_values) | (np.isnan(text_values) & np.isnan(layout_values))
+        comparison["Match"] = np.where(same, "✅", "⚠️")
+        st.dataframe(comparison.style.format({"Text Parser": "{:g}", "Layout Parser": "{:g}"}, na_rep="-"), hide_index=True)
 
 # --- 显示 Serology 结果 ---
-sero_results = None
 if raw_text:
-    sero_results = extract_serology(raw_text)
     st.subheader("🧬 Serology Results")
     st.table(pd.DataFrame(list(sero_results.items()), columns=["Test", "Result"]))
 
 # --- KT/V & URR 计算 ---
-results_dict = {row[0]: row[1] for row in results}
-
 kt_v = None
 URR = None
 
-try:
-    urea = float(results_dict["Urea"].replace("*", ""))
-    post_urea = float(results_dict["Urea - Post Dialysis"].replace("*", ""))
-
-    R = post_urea / urea
-    URR = round((1 - R) * 100, 2)
-    kt_v = -math.log(R - 0.008 * dialysis_time) + ((4 - 3.5 * R) * (uf_volume / post_weight))
-    kt_v = round(kt_v, 2)
-
-    st.subheader("⏳ KT/V & URR Results")
-    st.table(pd.DataFrame({
-        "Metric": ["URR (%)", "KT/V"],
-        "Value": [URR, kt_v]
-    }))
-except Exception as e:
-    st.warning(f"⚠️ Cannot calculate KT/V & URR: {e}")
+if results is not None:
+    try:
+        with span("kt_v"):
+            URR, kt_v = calculate_adequacy(results, dialysis_time, uf_volume, post_weight)
+
+        st.subheader("⏳ KT/V & URR Results")
+        st.table(pd.DataFrame({
+            "Metric": ["URR (%)", "KT/V"],
+            "Value": [URR, kt_v]
+        }))
+    except Exception as e:
+        st.warning(f"⚠️ Cannot calculate KT/V & URR: {e}")
+
+# --- 📈 Patient History (opt-in, stored locally in SQLite) ---
+@st.cache_resource
+def get_result_store():
+    return ResultStore()
+
+if raw_text:
+    st.subheader("📈 Patient History")
+    # Read from the report, but a misread ID would file the report under the
+    # wrong patient, so it is shown for checking before anything is saved
+    patient_id = st.text_input("Patient ID", key="patient_id", help="Read from the report; check or correct it before saving").strip()
+    if not patient_id:
+        st.caption("Enter the patient ID to save this report or see its history.")
+    else:
+        result_store = get_result_store()
+        if st.button("💾 Save this report to patient history", help="Stores the lab values, serology and KT/V/URR on this server, keyed by patient ID"):
+            saved = result_store.add_report({
+                "file_sha256": file_digest,
+                "patient_id": patient_id,
+                "patient_name": st.session_state.patient_info.get("name", ""),
+                "report_date": report.report_date or datetime.now().date().isoformat(),
+                "results": results.records(converted_only=True),
+                "serology": sero_results,
+                "urr": URR,
+                "kt_v": kt_v,
+                "source": uploaded_file.name,
+            })
+            st.success(f"✅ Report saved under {patient_id}." if saved else "ℹ️ This report is already in the history.")
+
+        trend_tests = st.multiselect("Trend tests", list(items_info) + ["URR (%)", "KT/V"], default=["Potassium", "KT/V"])
+        history = result_store.history(patient_id, tests=trend_tests, months=12)
+        if history:
+            trend = pd.DataFrame(history, columns=["Date", "Test", "Value", "Abnormal"])
+            st.line_chart(trend.pivot_table(index="Date", columns="Test", values="Value"))
+            st.caption(f"{result_store.report_count(patient_id)} saved report(s) for patient {patient_id}, last 12 months shown")
+        else:
+            st.caption("No saved reports for this patient in the last 12 months." if trend_tests else "Pick tests to chart.")
+
+charge_attempt = rate_limiter.charger(RATE_LIMIT_QUEUE_SECONDS)
+
+# --- Chat Rendering ---
+USER_MESSAGE_HTML = '<div style="background-color: rgba(70, 130, 180, 0.3); padding: 1rem; border-radius: 10px; margin: 0.5rem 0; border-left: 4px solid #4682B4;">👤 <strong>You:</strong><br>{}</div>'
+AI_MESSAGE_HTML = '<div class="ai-suggestion">🤖 <strong>AI Assistant:</strong><br>{}</div>'
+
+# --- Background AI Jobs ---
+# Generate and Send only submit a job and keep its ID in session state; the
+# model call runs on the shared job executor, so the page stays usable (tables,
+# parameters, history) while the answer streams in. A timer fragment polls the
+# job and shows the partial answer until it finishes.
+JOB_POLL_SECONDS = 1.0
+ANALYSIS_JOB_TIMEOUT = 120
+FOLLOW_UP_JOB_TIMEOUT = 90
+
+def submit_ai_job(kind, prompt, timeout, on_complete=None, **meta):
+    dispatcher, resolver = get_ai_dispatcher(), get_model_resolver()
+    st.session_state.ai_job_id = get_job_executor().submit(
+        st.session_state.session_id, kind,
+        lambda: dispatcher.stream(resolver, prompt, charge=charge_attempt),
+        timeout=timeout, on_complete=on_complete, meta=meta,
+    )
+
+def cancel_ai_job():
+    job_id = st.session_state.get("ai_job_id")
+    if job_id:
+        get_job_executor().cancel(job_id, st.session_state.session_id)
+        get_job_executor().discard(job_id, st.session_state.session_id)
+        st.session_state.ai_job_id = None
+
+def collect_ai_job(job):
+    # Moves a finished job's answer into the chat and keeps how it ended in
+    # ai_job_outcome, which job_panel shows until the panels around it rerun
+    st.session_state.ai_job_id = None
+    get_job_executor().discard(job.job_id, st.session_state.session_id)
+    if job.status == DONE:
+        st.session_state.ai_job_outcome = [("answer", job.text)]
+        st.session_state.chat_history.append({
+            "role": "assistant",
+            "content": job.text
+        })
+        # Older turns move to a compressed archive (already in the rolling summary)
+        trim_chat_history(
+            st.session_state.chat_history,
+            st.session_state.setdefault("chat_archive", []),
+            st.session_state.setdefault("conversation_memory", ConversationMemory()),
+        )
+        if job.kind == "analysis":
+            st.session_state.initial_analysis_done = True
+            st.session_state.context = job.meta["context"]
+    elif job.kind == "analysis":
+        st.session_state.ai_job_outcome = [
+            ("error", f"❌ Error generating AI analysis: {job.error or job.status}"),
+            ("info", "Please check the API configuration, then use 🔄 Start New Analysis to try again."),
+        ]
+    else:
+        st.session_state.ai_job_outcome = [("error", f"❌ Error: {job.error or job.status}")]
+
+def show_ai_job_outcome():
+    for kind, text in st.session_state.get("ai_job_outcome") or []:
+        if kind == "answer":
+            st.markdown(AI_MESSAGE_HTML.format(text), unsafe_allow_html=True)
+        else:
+            getattr(st, kind)(text)
+
+# Streams the pending job in place. When it ends only this fragment reruns and
+# shows the answer (or error) where the stream was; the chat around it picks
+# the answer up from chat_history the next time it reruns.
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def job_panel():
+    job = get_job_executor().get(st.session_state.get("ai_job_id"), st.session_state.session_id)
+    if job is not None and job.finished:
+        collect_ai_job(job)
+        rerun_panel()
+    if job is None:
+        st.session_state.ai_job_id = None
+        show_ai_job_outcome()
+        return
+
+    if job.parts:
+        st.markdown(AI_MESSAGE_HTML.format(job.text + " ▌"), unsafe_allow_html=True)
+    label = "🧠 AI is analyzing the blood test results..." if job.kind == "analysis" else "🤖 Thinking..."
+    col1, col2 = st.columns([5, 1])
+    with col1:
+        queued = " (waiting for a free model slot)" if job.status == QUEUED else ""
+        st.caption(f"{label} {int(job.elapsed)}s{queued}")
+    with col2:
+        if st.button("✖ Cancel", key="cancel_ai_job", use_container_width=True):
+            cancel_ai_job()
+            st.session_state.ai_job_outcome = [("info", "Request cancelled.")]
+            rerun_panel()
 
 # --- AI Analysis Section ---
-if raw_text and results and ai_enabled:
+# Both panels are fragments: Generate, Send and Start New Analysis rerun only
+# their own panel, so a chat turn never re-runs parsing, the tables or KT/V
+# above it. The report arrives as the session's immutable snapshot.
+
+def rerun_panel():
+    # Reruns only the calling fragment; a click handled during a full app run
+    # (e.g. the first run after a page reload) falls back to a full rerun
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+# Follow-up chat (nested inside ai_panel); a Send reruns only this panel
+@st.fragment
+def chat_panel():
+    job_pending = bool(st.session_state.get("ai_job_id"))
+    # A job that ends while this panel is on screen is shown by job_panel; the
+    # history below already includes it
+    st.session_state.pop("ai_job_outcome", None)
+    # Send is checked on click rather than disabled: the job can finish inside
+    # job_panel without this panel rerunning
+    button_disabled = rate_limiter.get_wait_time() > RATE_LIMIT_QUEUE_SECONDS
+    
+    archive = st.session_state.get("chat_archive")
+    if archive and st.toggle("🗂️ Show earlier messages", key="show_chat_archive"):
+        earlier = load_archive(archive)
+        st.caption(f"{len(earlier)} earlier message(s), kept compressed")
+    else:
+        earlier = []
+    
+    for message in earlier + st.session_state.chat_history:
+        if message["role"] == "user":
+            st.markdown(USER_MESSAGE_HTML.format(message["content"]), unsafe_allow_html=True)
+        else:
+            st.markdown(AI_MESSAGE_HTML.format(message["content"]), unsafe_allow_html=True)
+    
+    if job_pending:
+        job_panel()
+    
+    st.markdown("### 💬 Ask Follow-up Questions")
+    
+    col1, col2 = st.columns([5, 1])
+    
+    with col1:
+        user_question = st.text_input(
+            "Ask anything about the blood test results...",
+            placeholder="e.g., What foods should this patient avoid? Why is the potassium high?",
+            key="user_input",
+            label_visibility="collapsed"
+        )
+    
+    with col2:
+        send_button = st.button("Send", type="primary", disabled=button_disabled, use_container_width=True)
+    
+    if send_button and user_question:
+        if st.session_state.get("ai_job_id"):
+            st.info("⏳ Please wait for the current answer to finish.")
+        elif not st.session_state.initial_analysis_done:
+            st.info("The analysis did not finish. Use 🔄 Start New Analysis to try again.")
+        elif rate_limiter.get_wait_time() <= RATE_LIMIT_QUEUE_SECONDS:
+            # Older turns go in as a rolling summary, only the latest verbatim
+            prompt_started = time.perf_counter()
+            memory = st.session_state.setdefault("conversation_memory", ConversationMemory())
+            conversation = memory.build_followup_prompt(st.session_state.context, st.session_state.chat_history, user_question)
+            registry.observe("prompt_build", time.perf_counter() - prompt_started, kind="follow_up")
+            registry.increment("prompt_tokens_estimated_total", estimate_tokens(conversation), kind="follow_up")
+            st.session_state.chat_history.append({
+                "role": "user",
+                "content": user_question
+            })
+            submit_ai_job("follow_up", conversation, FOLLOW_UP_JOB_TIMEOUT)
+            rerun_panel()
+        else:
+            wait_time = int(rate_limiter.get_wait_time())
+            st.error(f"⏱️ Rate limit reached. Please wait {wait_time} seconds.")
+
+# Initial analysis; Generate and Start New Analysis rerun this panel and the chat inside it
+@st.fragment
+def ai_panel(report, results, kt_v, URR, patient_age, patient_conditions, current_medications, dialysis_time, uf_volume, post_weight):
     st.markdown("---")
     st.subheader("🤖 AI-Powered Clinical Insights")
     
@@ -386,197 +658,83 @@ if raw_text and results and ai_enabled:
         st.session_state.initial_analysis_done = False
     
     remaining = rate_limiter.get_remaining_requests()
+    wait_time = rate_limiter.get_wait_time()
     if remaining > 0:
-        st.markdown(f'<div class="rate-limit-info">📊 AI requests remaining: <strong>{remaining}/15</strong> (resets every minute)</div>', unsafe_allow_html=True)
+        st.markdown(f'<div class="rate-limit-info">📊 AI requests remaining: <strong>{remaining}/{rate_limiter.max_requests}</strong> (refills continuously)</div>', unsafe_allow_html=True)
+    elif wait_time <= RATE_LIMIT_QUEUE_SECONDS:
+        st.markdown(f'<div class="rate-limit-info">⏳ Shared API quota is busy. Your next request will be queued for about <strong>{int(wait_time) + 1}</strong> seconds.</div>', unsafe_allow_html=True)
     else:
-        wait_time = int(rate_limiter.get_wait_time())
-        st.markdown(f'<div class="warning-box">⏱️ Rate limit reached. Please wait <strong>{wait_time}</strong> seconds before next request.</div>', unsafe_allow_html=True)
+        st.markdown(f'<div class="warning-box">⏱️ Rate limit reached. Please wait <strong>{int(wait_time)}</strong> seconds before next request.</div>', unsafe_allow_html=True)
     
-    button_disabled = not rate_limiter.can_make_request()
+    # A failed analysis was already shown in job_panel; the Generate button is back
+    st.session_state.pop("ai_job_outcome", None)
     
-    if not st.session_state.initial_analysis_done:
+    button_disabled = wait_time > RATE_LIMIT_QUEUE_SECONDS
+    
+    # The chat opens as soon as the analysis is requested; it streams in as the
+    # first message, so finishing it needs no rerun of this panel
+    analysis_requested = st.session_state.initial_analysis_done or bool(st.session_state.get("ai_job_id"))
+    if not analysis_requested:
         if st.button("🔍 Generate AI Analysis & Recommendations", type="primary", disabled=button_disabled):
-            if rate_limiter.can_make_request():
-                with st.spinner("🧠 AI is analyzing the blood test results..."):
-                    try:
-                        rate_limiter.add_request()
-                        
-                        lab_results_text = df.to_string()
-                        serology_text = pd.DataFrame(list(sero_results.items()), columns=["Test", "Result"]).to_string() if sero_results else "No serology data"
-                        kt_v_text = f"KT/V: {kt_v}, URR: {URR}%" if kt_v and URR else "KT/V and URR not calculated"
-                        
-                        context = f"""
-Patient Context:
-- Age: {patient_age if patient_age > 0 else 'Not provided'}
-- Known Conditions: {patient_conditions if patient_conditions else 'None specified'}
-- Current Medications: {current_medications if current_medications else 'None specified'}
-
-Lab Results:
-{lab_results_text}
-
-Serology Results:
-{serology_text}
-
-Dialysis Adequacy:
-{kt_v_text}
-- Dialysis Time: {dialysis_time} hours
-- Ultrafiltration: {uf_volume} L
-- Post-dialysis Weight: {post_weight} kg
-"""
-
-                        prompt = f"""You are an experienced nephrology and dialysis nurse assistant. Analyze the following blood test results and provide clinical insights.
-
-{context}
-
-Please provide:
-
-1. **Critical Findings**: Identify any values that are significantly abnormal and require immediate attention (marked with *)
-
-2. **Key Observations**: Summarize the overall picture - what do these results tell us about the patient's condition?
-
-3. **Dialysis Adequacy Assessment**: Evaluate the KT/V and URR values (KT/V target: ≥1.2, URR target: ≥65%)
-
-4. **Clinical Recommendations**: 
-   - Monitoring suggestions
-   - Potential medication adjustments to consider
-   - Dietary recommendations
-   - Follow-up testing if needed
-
-5. **Nursing Considerations**: Practical points for dialysis unit nurses managing this patient
-
-Please be specific, practical, and prioritize patient safety. Use clear language suitable for healthcare professionals."""
-
-                        try:
-                            model_to_use = None
-                            for m in genai.list_models():
-                                if 'generateContent' in m.supported_generation_methods:
-                                    model_to_use = m.name
-                                    break
-                            
-                            if model_to_use is None:
-                                raise Exception("No compatible Gemini models found. Please check your API key is from aistudio.google.com")
-                            
-                            model = genai.GenerativeModel(model_to_use)
-                            response = model.generate_content(prompt)
-                            ai_response = response.text
-                            
-                        except Exception as model_error:
-                            model_names_to_try = [
-                                'gemini-1.5-flash',
-                                'gemini-1.5-pro', 
-                                'gemini-pro',
-                            ]
-                            
-                            ai_response = None
-                            for model_name in model_names_to_try:
-                                try:
-                                    model = genai.GenerativeModel(model_name)
-                                    response = model.generate_content(prompt)
-                                    ai_response = response.text
-                                    break
-                                except:
-                                    continue
-                            
-                            if ai_response is None:
-                                raise Exception(f"Could not find working model. Original error: {model_error}")
-                        
-                        st.session_state.chat_history.append({
-                            "role": "assistant",
-                            "content": ai_response
-                        })
-                        st.session_state.initial_analysis_done = True
-                        st.session_state.context = context
-                        
-                        new_remaining = rate_limiter.get_remaining_requests()
-                        st.info(f"✅ Analysis complete. {new_remaining} requests remaining this minute.")
-                        
-                        st.rerun()
-                        
-                    except Exception as e:
-                        st.error(f"❌ Error generating AI analysis: {str(e)}")
-                        st.info("Please check the API configuration or try again later.")
+            if rate_limiter.get_wait_time() <= RATE_LIMIT_QUEUE_SECONDS:
+                prompt_started = time.perf_counter()
+                context = build_context(
+                    results, report.serology, kt_v, URR,
+                    patient_age, patient_conditions, current_medications,
+                    dialysis_time, uf_volume, post_weight,
+                )
+                prompt = build_analysis_prompt(context)
+                registry.observe("prompt_build", time.perf_counter() - prompt_started, kind="analysis")
+                registry.increment("prompt_tokens_estimated_total", estimate_tokens(prompt), kind="analysis")
+
+                model_resolver = get_model_resolver()
+                response_cache = get_response_cache()
+                cache_key = response_cache.make_key(prompt, PARSER_VERSION)
+                ai_response = response_cache.get(cache_key)
+                if ai_response is not None:
+                    # Identical report and context: served without a Gemini call or a rate-limit slot
+                    st.session_state.chat_history.append({
+                        "role": "assistant",
+                        "content": ai_response
+                    })
+                    st.session_state.initial_analysis_done = True
+                    st.session_state.context = context
+                else:
+                    def cache_response(job):
+                        response_cache.put(cache_key, model_resolver.current_model(), job.text)
+                    submit_ai_job("analysis", prompt, ANALYSIS_JOB_TIMEOUT, on_complete=cache_response, context=context)
+                rerun_panel()
             else:
                 wait_time = int(rate_limiter.get_wait_time())
                 st.error(f"⏱️ Rate limit exceeded. Please wait {wait_time} seconds before making another request.")
     
-    if st.session_state.initial_analysis_done:
+    if analysis_requested:
         st.markdown("---")
-        
-        for message in st.session_state.chat_history:
-            if message["role"] == "user":
-                st.markdown(f'<div style="background-color: rgba(70, 130, 180, 0.3); padding: 1rem; border-radius: 10px; margin: 0.5rem 0; border-left: 4px solid #4682B4;">👤 <strong>You:</strong><br>{message["content"]}</div>', unsafe_allow_html=True)
-            else:
-                st.markdown(f'<div class="ai-suggestion">🤖 <strong>AI Assistant:</strong><br>{message["content"]}</div>', unsafe_allow_html=True)
-        
-        st.markdown("### 💬 Ask Follow-up Questions")
-        
-        col1, col2 = st.columns([5, 1])
-        
-        with col1:
-            user_question = st.text_input(
-                "Ask anything about the blood test results...",
-                placeholder="e.g., What foods should this patient avoid? Why is the potassium high?",
-                key="user_input",
-                label_visibility="collapsed"
-            )
-        
-        with col2:
-            send_button = st.button("Send", type="primary", disabled=button_disabled, use_container_width=True)
-        
-        if send_button and user_question:
-            if rate_limiter.can_make_request():
-                with st.spinner("🤖 Thinking..."):
-                    try:
-                        rate_limiter.add_request()
-                        
-                        st.session_state.chat_history.append({
-                            "role": "user",
-                            "content": user_question
-                        })
-                        
-                        conversation = f"""
-You are an experienced nephrology and dialysis nurse assistant. Continue the conversation about this patient's blood test results.
-
-{st.session_state.context}
-
-Previous conversation:
-"""
-                        for msg in st.session_state.chat_history[-4:]:
-                            role = "Nurse" if msg["role"] == "user" else "Assistant"
-                            conversation += f"\n{role}: {msg['content']}\n"
-                        
-                        conversation += f"\nNurse: {user_question}\n\nAssistant:"
-                        
-                        model_to_use = None
-                        for m in genai.list_models():
-                            if 'generateContent' in m.supported_generation_methods:
-                                model_to_use = m.name
-                                break
-                        
-                        model = genai.GenerativeModel(model_to_use)
-                        response = model.generate_content(conversation)
-                        ai_response = response.text
-                        
-                        st.session_state.chat_history.append({
-                            "role": "assistant",
-                            "content": ai_response
-                        })
-                        
-                        st.rerun()
-                        
-                    except Exception as e:
-                        st.error(f"❌ Error: {str(e)}")
-            else:
-                wait_time = int(rate_limiter.get_wait_time())
-                st.error(f"⏱️ Rate limit reached. Please wait {wait_time} seconds.")
-        
+        chat_panel()
+
         if st.button("🔄 Start New Analysis", type="secondary"):
+            cancel_ai_job()
             st.session_state.chat_history = []
+            st.session_state.chat_archive = []
             st.session_state.initial_analysis_done = False
-            st.rerun()
+            st.session_state.conversation_memory = ConversationMemory()
+            rerun_panel()
         
         st.markdown("---")
         st.warning("⚠️ **Disclaimer**: This AI analysis is for informational purposes only and should not replace professional clinical judgment. Always consult with a physician for medical decisions.")
 
-elif raw_text and results and not ai_enabled:
+if results is not None and ai_enabled:
+    ai_panel(report, results, kt_v, URR, patient_age, patient_conditions, current_medications, dialysis_time, uf_volume, post_weight)
+elif results is not None and not ai_enabled:
     st.info("💡 AI analysis is not configured. Get your free API key from: https://aistudio.google.com/app/apikey")
+
+# --- ⏱️ Stage Timings (rendered last so this run's spans are included) ---
+if debug_expander is not None and registry.enabled:
+    with debug_expander:
+        st.caption("⏱️ Stage Timings (all sessions since server start)")
+        span_rows, counters = registry.snapshot()
+        if span_rows:
+            st.dataframe(pd.DataFrame(span_rows), hide_index=True)
+        for name, value in counters.items():
+            st.text(f"{name}: {value}")
+        st.download_button("⬇️ Export metrics (Prometheus text)", registry.prometheus_text(), file_name="metrics.prom", mime="text/plain")
@@ -0,0 +1,159 @@
+import argparse
+import glob
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import pandas as pd
+
+from lab_parser import parse_report, extract_lab_results_layout
+from lab_results import lab_table
+from adequacy import adequacy_frame
+from result_store import DEFAULT_STORE_PATH, ResultStore
+
+# Headless batch mode: parse a directory (or glob) of lab PDFs across a process
+# pool and write one consolidated table, one row per report.
+#
+#   python batch.py reports/2025-03 -o march.csv --workers 8
+#   python batch.py "reports/**/*.pdf" -o year.parquet
+
+
+# --- 收集 PDF 文件 ---
+def collect_pdfs(inputs):
+    paths = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            matches = glob.glob(os.path.join(entry, "**", "*.pdf"), recursive=True)
+            matches += glob.glob(os.path.join(entry, "**", "*.PDF"), recursive=True)
+        elif os.path.isfile(entry):
+            matches = [entry]
+        else:
+            matches = glob.glob(entry, recursive=True)
+        paths.extend(matches)
+    return sorted(set(paths))
+
+
+# --- 单个报告 (runs in a worker process) ---
+# Returns the output table row and, for the result store, the parsed report
+# with its lab readings as printed (converted and flagged later, all at once)
+def process_pdf(task):
+    path, parser = task
+    row = {"File": path}
+    try:
+        with open(path, "rb") as f:
+            file_bytes = f.read()
+        parsed = parse_report(file_bytes)
+        if parser == "layout":
+            parsed["results"] = extract_lab_results_layout(file_bytes)
+    except Exception as e:
+        row["Error"] = f"Cannot read PDF: {e}"
+        return row, None
+
+    info = parsed["patient_info"]
+    # Reports without a printed date fall back to the file's modification date
+    report_date = parsed["report_date"] or date.fromtimestamp(os.path.getmtime(path)).isoformat()
+    row.update({
+        "Patient ID": info["id"],
+        "Patient Name": info["name"],
+        "Age": info["age"] or None,
+        "Sex": info["sex"],
+        "Report Date": report_date,
+        "Pages": parsed["page_count"],
+    })
+    for test, result in (parsed["serology"] or {}).items():
+        row[test] = result
+
+    record = {
+        "file_sha256": hashlib.sha256(file_bytes).hexdigest(),
+        "patient_id": info["id"],
+        "patient_name": info["name"],
+        "report_date": report_date,
+        "readings": parsed["results"],
+        "serology": parsed["serology"],
+        "source": path,
+    }
+    return row, record
+
+
+def write_table(df, output):
+    if output.lower().endswith(".parquet"):
+        try:
+            df.to_parquet(output, index=False)
+        except ImportError as e:
+            sys.exit(f"❌ Parquet output needs pyarrow (pip install pyarrow): {e}")
+    else:
+        df.to_csv(output, index=False, encoding="utf-8-sig")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch-extract lab results, serology and KT/V/URR from PDF reports.")
+    parser.add_argument("inputs", nargs="+", help="PDF files, directories (searched recursively) or glob patterns")
+    parser.add_argument("-o", "--output", default="lab_results.csv", help="Output table, .csv or .parquet (default: lab_results.csv)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="Worker processes (default: CPU count)")
+    parser.add_argument("--dialysis-time", type=float, default=4.0, help="Dialysis duration in hours (default: 4.0)")
+    parser.add_argument("--uf-volume", type=float, default=2.0, help="Ultrafiltration volume in L (default: 2.0)")
+    parser.add_argument("--post-weight", type=float, default=70.0, help="Post-dialysis weight in kg (default: 70.0)")
+    parser.add_argument("--store", nargs="?", const=DEFAULT_STORE_PATH, help=f"Also save reports to the patient history database (default path: {DEFAULT_STORE_PATH})")
+    parser.add_argument("--parser", choices=["text", "layout"], default="text", help="Lab value extraction: flattened text or word-coordinate rows (default: text)")
+    args = parser.parse_args(argv)
+
+    paths = collect_pdfs(args.inputs)
+    if not paths:
+        sys.exit("❌ No PDF files found.")
+
+    workers = max(1, min(args.workers, len(paths)))
+    tasks = [(path, args.parser) for path in paths]
+    print(f"📄 Processing {len(paths)} PDF{'s' if len(paths) > 1 else ''} with {workers} worker{'s' if workers > 1 else ''}...", file=sys.stderr)
+
+    start = time.perf_counter()
+    if workers == 1:
+        outputs = [process_pdf(task) for task in tasks]
+    else:
+        # Small chunks keep workers busy without one slow report stalling a large batch
+        chunksize = max(1, len(tasks) // (workers * 8))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            outputs = list(executor.map(process_pdf, tasks, chunksize=chunksize))
+    elapsed = time.perf_counter() - start
+
+    rows = pd.DataFrame([row for row, _ in outputs])
+    # One vectorized unit conversion and flag pass over the whole batch, with
+    # each report's own age / sex ranges; values land in numeric columns
+    lab = lab_table(
+        [record["readings"] if record else () for _, record in outputs],
+        rows["Age"] if "Age" in rows else 0,
+        rows["Sex"].fillna("") if "Sex" in rows else "",
+    )
+    lead = [c for c in ["File", "Patient ID", "Patient Name", "Age", "Sex", "Report Date", "Pages"] if c in rows]
+    df = pd.concat([rows[lead], lab.wide(), rows.drop(columns=lead)], axis=1)
+    # One vectorized KT/V & URR pass over the whole batch; invalid rows stay empty
+    if "Urea" in df:
+        df = adequacy_frame(df, args.dialysis_time, args.uf_volume, args.post_weight)
+    if "Error" in df:
+        df = df[[c for c in df.columns if c != "Error"] + ["Error"]]
+    write_table(df, args.output)
+
+    if args.store:
+        # Only reports with a patient ID can be tracked over time
+        records = []
+        for i, (_, record) in enumerate(outputs):
+            if record and record["patient_id"]:
+                record["results"] = lab.records(i, converted_only=True)
+                if "KT/V" in df:
+                    record["urr"] = None if pd.isna(df["URR (%)"].iat[i]) else float(df["URR (%)"].iat[i])
+                    record["kt_v"] = None if pd.isna(df["KT/V"].iat[i]) else float(df["KT/V"].iat[i])
+                records.append(record)
+        store_start = time.perf_counter()
+        added = ResultStore(args.store).add_reports(records)
+        print(f"💾 Stored {added} new or re-filed report(s) in {args.store} ({len(records) - added} already present) in {time.perf_counter() - store_start:.2f}s", file=sys.stderr)
+
+    failed = int(df["Error"].notna().sum()) if "Error" in df else 0
+    print(f"✅ Wrote {len(df)} rows to {args.output}", file=sys.stderr)
+    print(f"⏱️ {elapsed:.2f}s total, {len(paths) / elapsed:.1f} PDFs/sec ({failed} with errors)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+# Benchmark suite: synthetic lab-report PDFs, per-stage parser timings and
+# an offline multi-session load test.
+#
+#   python -m benchmarks.run -o bench.json
+#   python -m benchmarks.run --compare bench.json
+#   python -m benchmarks.load --nurses 20 --duration 120
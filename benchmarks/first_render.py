@@ -0,0 +1,68 @@
+import io
+import os
+import sys
+
+import fitz
+
+# --- First Render Check ---
+# Uploads a one-page report for a 54-year-old man with Haemoglobin 125 g/L
+# (low for a man, in range for a woman or an unknown sex) and runs app.py once
+# with Streamlit's AppTest. The sidebar must show the report's age and sex and
+# the lab table must flag Haemoglobin "L" on that first render.
+#
+#   python -m benchmarks.first_render
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+class Upload(io.BytesIO):
+    # What the app reads from a Streamlit UploadedFile
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.file_id = name
+
+
+def make_pdf():
+    doc = fitz.open()
+    page = doc.new_page()
+    for i, text in enumerate(["Patient Name: John Tan", "Sex: Male", "Age: 54", "Haemoglobin  125  g/L  130 - 170"]):
+        page.insert_text((50, 60 + 14 * i), text, fontsize=10)
+    return doc.tobytes()
+
+
+def check():
+    from streamlit.testing.v1 import AppTest
+
+    os.environ["AI_BACKEND"] = "stub"
+    at = AppTest.from_file(APP, default_timeout=60)
+    at.session_state["single_upload"] = Upload(make_pdf(), "first_render.pdf")
+    at.run()
+
+    problems = [f"exception: {e.value}" for e in at.exception]
+    if at.number_input(key="patient_age").value != 54:
+        problems.append(f"sidebar age is {at.number_input(key='patient_age').value}, expected 54")
+    if at.selectbox(key="patient_sex").value != "M":
+        problems.append(f"sidebar sex is {at.selectbox(key='patient_sex').value!r}, expected 'M'")
+    # Other tables (e.g. the stage timings in the debug expander) can come first
+    table = next((d.value for d in at.dataframe if "Test" in d.value.columns), None)
+    if table is None:
+        problems.append("no lab table rendered")
+    else:
+        flag = table.loc[table["Test"] == "Haemoglobin", "Flag"].iloc[0]
+        if flag != "L":
+            problems.append(f"Haemoglobin 125 g/L flagged {flag!r}, expected 'L'")
+    return problems
+
+
+def main():
+    problems = check()
+    for problem in problems:
+        print(f"❌ {problem}", file=sys.stderr)
+    if not problems:
+        print("✅ First render flags the report with its own age and sex")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+from lab_parser import PARSER_VERSION, parse_report
+from lab_results import lab_table
+from adequacy import calculate_adequacy
+from ai_client import HedgedDispatcher, ModelResolver
+from ai_jobs import DONE, FAILED, JobExecutor
+from fake_gemini import FakeGemini
+from prompt_builder import ConversationMemory, build_analysis_prompt, build_context
+from rate_limiter import GlobalRateLimiter, RateLimiter
+from response_cache import ResponseCache
+from benchmarks.run import git_revision, summarize
+from benchmarks.synthetic import make_reports
+
+# --- Offline Load Test ---
+# N simulated nurses share one "server": the same process-wide rate limiter,
+# model resolver, hedged dispatcher, job executor and response cache that
+# app.py builds with st.cache_resource, with the Gemini SDK replaced by
+# fake_gemini.FakeGemini. Each nurse loops: parse a synthetic PDF, generate
+# the analysis through a background job (polled like the UI does), then ask
+# follow-ups, with exponential think time in between. Streamlit itself is not
+# involved, so the numbers are for the parsing and AI paths.
+#
+#   python -m benchmarks.load --nurses 20 --duration 120
+#   python -m benchmarks.load --stub "latency=lognormal:2,0.6 rate_limit_rate=0.05" --rpm 30 -o load.json
+
+QUESTIONS = [
+    "What foods should this patient avoid?",
+    "Why is the potassium high?",
+    "Is the dialysis dose adequate?",
+    "Which results need a repeat test?",
+    "What should I tell the patient about phosphate binders?",
+]
+
+# Outcomes that count as a finished user action in the latency percentiles
+COMPLETED = ("ok", DONE, "cached")
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def record(self, op, outcome, seconds=None):
+        with self._lock:
+            self.outcomes[op][outcome] += 1
+            if seconds is not None and outcome in COMPLETED:
+                self.latencies[op].append(seconds)
+
+
+class Server:
+    def __init__(self, sdk, rpm, max_in_flight, hedge_after):
+        self.sdk = sdk
+        self.limiter = GlobalRateLimiter(max_requests=rpm, time_window=60)
+        self.resolver = ModelResolver(ttl=3600, sdk=sdk)
+        self.dispatcher = HedgedDispatcher(max_workers=8, hedge_after=hedge_after, attempt_timeout=60.0)
+        self.jobs = JobExecutor(max_workers=16, max_in_flight=max_in_flight, default_timeout=120.0)
+        self.cache = ResponseCache(path="")
+
+
+def run_job(server, session_id, kind, prompt, charge, poll):
+    job_id = server.jobs.submit(session_id, kind, lambda: server.dispatcher.stream(server.resolver, prompt, charge=charge))
+    job = server.jobs.get(job_id, session_id)
+    while not job.finished:
+        time.sleep(poll)
+    server.jobs.discard(job_id, session_id)
+    if job.status == FAILED and "Rate limit" in (job.error or ""):
+        return job, "rate_limited"
+    return job, job.status
+
+
+def nurse(index, server, reports, args, recorder, deadline):
+    rng = random.Random(args.seed + index)
+    session_id = f"nurse-{index}"
+    rate_limiter = RateLimiter(server.limiter, session_id)
+    charge = rate_limiter.charger(args.queue_seconds)
+
+    def think():
+        time.sleep(rng.expovariate(1 / args.think) if args.think > 0 else 0)
+
+    def can_send(op):
+        # The app disables its buttons while the wait is longer than the queue window
+        if rate_limiter.get_wait_time() > args.queue_seconds:
+            recorder.record(op, "button_disabled")
+            return False
+        return True
+
+    while time.monotonic() < deadline:
+        pdf_bytes, _, _ = rng.choice(reports)
+        started = time.perf_counter()
+        parsed = parse_report(pdf_bytes)
+        info = parsed["patient_info"]
+        results = lab_table([parsed["results"]], info["age"], info["sex"])
+        try:
+            URR, kt_v = calculate_adequacy(results, 4.0, 2.0, 70.0)
+        except ValueError:
+            URR, kt_v = None, None
+        recorder.record("upload", "ok", time.perf_counter() - started)
+
+        context = build_context(
+            results, parsed["serology"], kt_v, URR,
+            parsed["patient_info"]["age"], "", "", 4.0, 2.0, 70.0,
+        )
+        prompt = build_analysis_prompt(context)
+        think()
+        if not can_send("analysis"):
+            continue
+        started = time.perf_counter()
+        key = server.cache.make_key(prompt, PARSER_VERSION)
+        answer = server.cache.get(key)
+        if answer is not None:
+            recorder.record("analysis", "cached", time.perf_counter() - started)
+        else:
+            job, outcome = run_job(server, session_id, "analysis", prompt, charge, args.poll)
+            recorder.record("analysis", outcome, time.perf_counter() - started)
+            if job.status != DONE:
+                think()
+                continue
+            answer = job.text
+            server.cache.put(key, server.resolver.current_model(), answer)
+
+        history = [{"role": "assistant", "content": answer}]
+        memory = ConversationMemory()
+        for _ in range(args.followups):
+            think()
+            if time.monotonic() >= deadline:
+                break
+            if not can_send("follow_up"):
+                continue
+            question = rng.choice(QUESTIONS)
+            started = time.perf_counter()
+            conversation = memory.build_followup_prompt(context, history, question)
+            history.append({"role": "user", "content": question})
+            job, outcome = run_job(server, session_id, "follow_up", conversation, charge, args.poll)
+            recorder.record("follow_up", outcome, time.perf_counter() - started)
+            if job.status == DONE:
+                history.append({"role": "assistant", "content": job.text})
+        think()
+
+
+def run_load(args):
+    sdk = FakeGemini.from_spec(args.stub)
+    server = Server(sdk, args.rpm, args.max_in_flight, args.hedge_after)
+    print(f"📄 Generating {args.reports} synthetic reports...", file=sys.stderr)
+    reports = make_reports(args.reports, seed=args.seed, pages=args.pages)
+
+    recorder = Recorder()
+    print(f"👩‍⚕️ {args.nurses} nurses for {args.duration:.0f}s (model stand-in: {args.stub or 'defaults'})...", file=sys.stderr)
+    started = time.perf_counter()
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(target=nurse, args=(i, server, reports, args, recorder, deadline), name=f"nurse-{i}")
+        for i in range(args.nurses)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    ops = {}
+    for op, outcomes in sorted(recorder.outcomes.items()):
+        entry = {"outcomes": dict(outcomes), "completed": sum(outcomes[o] for o in COMPLETED)}
+        if recorder.latencies[op]:
+            entry.update(summarize(recorder.latencies[op]))
+        ops[op] = entry
+    answers = sum(ops.get(op, {}).get("completed", 0) for op in ("analysis", "follow_up"))
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "options": {k: v for k, v in vars(args).items() if k != "output"},
+        "elapsed_s": round(elapsed, 2),
+        "answers_per_min": round(answers / elapsed * 60, 2),
+        "ops": ops,
+        "rate_limiter": server.limiter.stats(),
+        "model": sdk.stats(),
+        "jobs": server.jobs.stats(),
+        "cache": server.cache.stats(),
+    }
+
+
+def print_load_report(report):
+    print(f"\n{report['elapsed_s']:.0f}s, {report['answers_per_min']:.1f} AI answers/min")
+    print(f"  {'operation':<11}{'done':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  outcomes")
+    for op, s in report["ops"].items():
+        outcomes = ", ".join(f"{k} {v}" for k, v in sorted(s["outcomes"].items()))
+        if "p50_ms" in s:
+            print(f"  {op:<11}{s['completed']:>7}{s['p50_ms']:>10.0f}{s['p95_ms']:>10.0f}{s['p99_ms']:>10.0f}  {outcomes}")
+        else:
+            print(f"  {op:<11}{s['completed']:>7}{'-':>10}{'-':>10}{'-':>10}  {outcomes}")
+    limiter, model = report["rate_limiter"], report["model"]
+    print(f"  rate limiter: {limiter['rejections']} rejections, {limiter['active_sessions']} sessions")
+    print(f"  model stand-in: {model['calls']} calls, {model['rate_limited']} × 429, {model['errors']} errors")
+    print(f"  response cache: {report['cache']['memory_hits']} hits / {report['cache']['misses']} misses")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test of the parsing and AI paths with a local Gemini stand-in.")
+    parser.add_argument("-o", "--output", help="Write results to this JSON file")
+    parser.add_argument("--nurses", type=int, default=10, help="Concurrent simulated sessions (default: 10)")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to run (default: 60)")
+    parser.add_argument("--followups", type=int, default=2, help="Follow-up questions after each analysis (default: 2)")
+    parser.add_argument("--think", type=float, default=5.0, help="Mean think time between actions in seconds (default: 5)")
+    parser.add_argument("--stub", default="latency=lognormal:1.5,0.5", help='Model stand-in settings, e.g. "latency=exp:2 error_rate=0.01 rate_limit_rate=0.05 response_chars=3000"')
+    parser.add_argument("--rpm", type=int, default=15, help="Shared rate limit in requests/minute (default: 15, as in the app)")
+    parser.add_argument("--queue-seconds", type=float, default=10.0, help="Longest quota wait that is queued instead of rejected (default: 10)")
+    parser.add_argument("--max-in-flight", type=int, default=4, help="Concurrent model calls across sessions (default: 4)")
+    parser.add_argument("--hedge-after", type=float, default=6.0, help="Seconds before a hedged backup model is tried (default: 6)")
+    parser.add_argument("--poll", type=float, default=0.25, help="Job polling interval in seconds (default: 0.25)")
+    parser.add_argument("--reports", type=int, default=20, help="Distinct synthetic reports; fewer means more cache hits (default: 20)")
+    parser.add_argument("--pages", type=int, default=3, help="Pages per synthetic report (default: 3)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    report = run_load(args)
+    print_load_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n✅ Wrote {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
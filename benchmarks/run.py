@@ -0,0 +1,264 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import fitz
+import numpy as np
+
+from lab_parser import (
+    PARSER_VERSION, ReportScanner, iter_page_text,
+    extract_patient_info, extract_lab_results, extract_serology,
+)
+from lab_results import lab_table
+from adequacy import calculate_adequacy
+from benchmarks.synthetic import make_reports
+
+# --- Per-stage Parser Benchmark ---
+# Times every stage of the upload path on synthetic reports, one report at a
+# time, in the same order app.py runs them. Latencies are wall-clock
+# (perf_counter); peak memory comes from a separate tracemalloc pass so the
+# tracing overhead never skews the timings.
+
+STAGES = ["open", "page_text", "patient_info", "markers", "serology", "flags", "kt_v", "total"]
+PERCENTILES = [50, 90, 95, 99]
+
+# Session inputs for the KT/V stage
+DIALYSIS_TIME, UF_VOLUME, POST_WEIGHT = 4.0, 2.0, 60.0
+
+
+def run_stages(pdf_bytes, clock=time.perf_counter):
+    # Returns ({stage: seconds}, lab results, serology) for one report; clock() is read
+    # exactly twice per stage, at its start and its end
+    timings = {}
+
+    t = clock()
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    timings["open"] = clock() - t
+
+    t = clock()
+    scanner = ReportScanner()
+    with doc:
+        for text in iter_page_text(doc):
+            scanner.feed(text)
+            if scanner.complete:
+                break
+    raw_text = scanner.text()
+    timings["page_text"] = clock() - t
+
+    t = clock()
+    info = extract_patient_info(raw_text)
+    timings["patient_info"] = clock() - t
+
+    t = clock()
+    results = extract_lab_results(raw_text)
+    timings["markers"] = clock() - t
+
+    t = clock()
+    serology = extract_serology(raw_text)
+    timings["serology"] = clock() - t
+
+    t = clock()
+    table = lab_table([results], info["age"], info["sex"])
+    timings["flags"] = clock() - t
+
+    t = clock()
+    try:
+        calculate_adequacy(table, DIALYSIS_TIME, UF_VOLUME, POST_WEIGHT)
+    except ValueError:
+        # Reports without both urea values still pay for the attempt
+        pass
+    timings["kt_v"] = clock() - t
+
+    timings["total"] = sum(timings.values())
+    return timings, results, serology
+
+
+def peak_memory(pdf_bytes):
+    # {stage: peak KiB traced while the stage ran}. The clock passed to
+    # run_stages resets the tracemalloc peak at each stage start and records
+    # it at each stage end instead of returning a time.
+    marks = []
+
+    def mark():
+        marks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        return 0.0
+
+    tracemalloc.start()
+    try:
+        run_stages(pdf_bytes, clock=mark)
+    finally:
+        tracemalloc.stop()
+    peaks = {stage: marks[2 * i + 1] / 1024 for i, stage in enumerate(STAGES[:-1])}
+    peaks["total"] = max(peaks.values())
+    return peaks
+
+
+def accuracy(results, expected):
+    # Share of generated markers read back with the value that was written
+    if not expected:
+        return 1.0
+    found = {test: value for test, value, _ in results}
+    return sum(found.get(test) == value for test, value in expected.items()) / len(expected)
+
+
+def serology_accuracy(serology, expected):
+    # Share of serology fields read as printed ("Not done" where none was printed)
+    return sum(serology.get(test) == result for test, result in expected.items()) / len(expected)
+
+
+def summarize(samples):
+    samples_ms = np.asarray(samples) * 1000
+    summary = {f"p{p}_ms": round(float(np.percentile(samples_ms, p)), 4) for p in PERCENTILES}
+    summary["mean_ms"] = round(float(samples_ms.mean()), 4)
+    summary["max_ms"] = round(float(samples_ms.max()), 4)
+    return summary
+
+
+def run_scenario(name, reports, repeat=3, warmup=1):
+    for pdf_bytes, _, _ in reports[:warmup]:
+        run_stages(pdf_bytes)
+
+    samples = {stage: [] for stage in STAGES}
+    scores = []
+    serology_scores = []
+    for _ in range(repeat):
+        for pdf_bytes, expected, expected_serology in reports:
+            timings, results, serology = run_stages(pdf_bytes)
+            for stage, seconds in timings.items():
+                samples[stage].append(seconds)
+            scores.append(accuracy(results, expected))
+            serology_scores.append(serology_accuracy(serology, expected_serology))
+
+    memory = [peak_memory(pdf_bytes) for pdf_bytes, _, _ in reports[:10]]
+    stages = {}
+    for stage in STAGES:
+        stages[stage] = summarize(samples[stage])
+        stages[stage]["peak_kib"] = round(max(m[stage] for m in memory), 1)
+    return {
+        "name": name,
+        "reports": len(reports),
+        "runs": len(samples["total"]),
+        "mean_pdf_kib": round(sum(len(b) for b, _, _ in reports) / len(reports) / 1024, 1),
+        "marker_accuracy": round(float(np.mean(scores)), 4),
+        "serology_accuracy": round(float(np.mean(serology_scores)), 4),
+        "stages": stages,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def max_rss_kib():
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def print_report(report, baseline=None):
+    base = {s["name"]: s for s in (baseline or {}).get("scenarios", [])}
+    for scenario in report["scenarios"]:
+        print(f"\n{scenario['name']}  ({scenario['runs']} runs, {scenario['mean_pdf_kib']} KiB/PDF, "
+              f"marker accuracy {scenario['marker_accuracy']:.1%}, serology accuracy {scenario['serology_accuracy']:.1%})")
+        print(f"  {'stage':<13}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak KiB':>10}{'vs base':>10}")
+        for stage, s in scenario["stages"].items():
+            delta = ""
+            old = base.get(scenario["name"], {}).get("stages", {}).get(stage)
+            if old and old["p50_ms"] > 0:
+                delta = f"{s['p50_ms'] / old['p50_ms']:.2f}x"
+            print(f"  {stage:<13}{s['p50_ms']:>10.3f}{s['p95_ms']:>10.3f}{s['p99_ms']:>10.3f}{s['peak_kib']:>10.1f}{delta:>10}")
+
+
+def regressions(report, baseline, threshold):
+    # (scenario, stage, ratio) where p50 got slower than threshold x baseline, or accuracy dropped
+    found = []
+    base = {s["name"]: s for s in baseline.get("scenarios", [])}
+    for scenario in report["scenarios"]:
+        old = base.get(scenario["name"])
+        if not old:
+            continue
+        for metric in ("marker_accuracy", "serology_accuracy"):
+            # Baselines from before serology accuracy was measured have no entry
+            if metric in old and scenario[metric] < old[metric]:
+                found.append((scenario["name"], metric, scenario[metric] / max(old[metric], 1e-9)))
+        for stage, s in scenario["stages"].items():
+            old_stage = old["stages"].get(stage)
+            if old_stage and old_stage["p50_ms"] > 0 and s["p50_ms"] / old_stage["p50_ms"] > threshold:
+                found.append((scenario["name"], stage, s["p50_ms"] / old_stage["p50_ms"]))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the lab report parser on synthetic PDFs.")
+    parser.add_argument("-o", "--output", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON from an earlier run; exits 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=1.25, help="p50 slowdown vs baseline that counts as a regression (default: 1.25)")
+    parser.add_argument("--reports", type=int, default=30, help="Synthetic reports per scenario (default: 30)")
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 5, 20], help="Page counts, one scenario each (default: 1 5 20)")
+    parser.add_argument("--marker-density", type=float, default=1.0, help="Share of known markers present in each report (default: 1.0)")
+    parser.add_argument("--alias-rate", type=float, default=0.2, help="Chance a marker is printed under an alias (default: 0.2)")
+    parser.add_argument("--no-serology", action="store_true", help="Leave the serology section out")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over each scenario's reports (default: 3)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    options = {
+        "marker_density": args.marker_density,
+        "alias_rate": args.alias_rate,
+        "serology": not args.no_serology,
+    }
+    scenarios = []
+    for pages in args.pages:
+        name = f"pages={pages}"
+        print(f"⏱️ {name}: generating {args.reports} reports...", file=sys.stderr)
+        reports = make_reports(args.reports, seed=args.seed, pages=pages, **options)
+        scenario = run_scenario(name, reports, repeat=args.repeat)
+        scenario["options"] = dict(options, pages=pages)
+        scenarios.append(scenario)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "parser_version": PARSER_VERSION,
+        "python": platform.python_version(),
+        "pymupdf": fitz.VersionBind,
+        "platform": platform.platform(),
+        "max_rss_kib": max_rss_kib(),
+        "scenarios": scenarios,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n✅ Wrote {args.output}", file=sys.stderr)
+
+    if baseline:
+        found = regressions(report, baseline, args.threshold)
+        for name, stage, ratio in found:
+            print(f"❌ {name} {stage}: {ratio:.2f}x baseline", file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+import random
+
+import fitz
+
+from lab_parser import items_info, aliases, reverse_alias, serology_info
+
+# --- Synthetic Lab Report Generator ---
+# Builds report PDFs in memory that look like the real ones to the parser:
+# a patient header, "<test>  <value>  <range>" table rows spread over the
+# pages, free-text filler and an optional serology block. Aliases (including
+# the Chinese ALT/AST names, drawn with PyMuPDF's built-in CJK font) replace
+# the canonical test name at `alias_rate`. The same seed gives the same PDF.
+
+PAGE_TOP = 60
+PAGE_BOTTOM = 780
+LINE_HEIGHT = 14
+
+SEROLOGY_LINES = [
+    "HIV Ag/Ab Combo {hiv}",
+    "Hepatitis B Surface antigen {hbsag}",
+    "Hepatitis B Surface antibody {hbsab} IU/L",
+    "Hepatitis C antibody {hcv}",
+    "Hepatitis B core antibody {hbcab}",
+]
+
+FILLER_LINES = [
+    "Specimen received in good condition. Results verified by the laboratory.",
+    "Please correlate clinically. Reference ranges apply to adult patients.",
+    "Haemolysed samples may falsely raise potassium and phosphate.",
+    "This report was generated electronically and does not require a signature.",
+]
+
+FIRST_NAMES = ["John", "Mei Ling", "Ahmad", "Siti", "Kumar", "Wei Jie"]
+LAST_NAMES = ["Tan", "Lim", "Abdullah", "Wong", "Raj", "Chen"]
+
+
+def _alias_choices(item):
+    return aliases.get(item, []) + reverse_alias.get(item, [])
+
+
+def _value(rng, low, high):
+    low = low if low is not None else 1.0
+    high = high if high is not None else low * 5
+    # Mostly in range, sometimes flagged
+    return round(rng.uniform(low * 0.7, high * 1.3), 1)
+
+
+def _line(page, y, text, x=50):
+    fontname = "helv" if text.isascii() else "china-s"
+    page.insert_text((x, y), text, fontsize=10, fontname=fontname)
+
+
+def make_report(pages=3, marker_density=1.0, alias_rate=0.2, serology=True, filler_lines=10, seed=0):
+    # Returns (pdf bytes, {test: value used}, {serology test: expected result})
+    # for one synthetic report
+    rng = random.Random(seed)
+    markers = [item for item in items_info if rng.random() < marker_density]
+    rng.shuffle(markers)
+
+    rows = []
+    expected = {}
+    expected_serology = {name: "Not done" for name in serology_info}
+    for item in markers:
+        unit, low, high = items_info[item]
+        value = _value(rng, low, high)
+        choices = _alias_choices(item)
+        name = rng.choice(choices) if choices and rng.random() < alias_rate else item
+        ref = f"{low} - {high}" if low is not None and high is not None else "-"
+        rows.append((name, f"{value}", unit, ref))
+        expected[item] = value
+
+    doc = fitz.open()
+    per_page = -(-len(rows) // pages) if rows else 0
+    for page_number in range(pages):
+        page = doc.new_page()
+        y = PAGE_TOP
+        if page_number == 0:
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            header = [
+                f"Patient Name: {name}",
+                f"Age: {rng.randint(25, 85)}",
+                f"MRN: SYN-{seed:06d}",
+                f"Report Date: {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2025",
+            ]
+            for text in header:
+                _line(page, y, text)
+                y += LINE_HEIGHT
+            y += LINE_HEIGHT
+
+        for name, value, unit, ref in rows[page_number * per_page:(page_number + 1) * per_page]:
+            _line(page, y, name)
+            _line(page, y, value, x=260)
+            _line(page, y, unit, x=330)
+            _line(page, y, ref, x=420)
+            y += LINE_HEIGHT
+
+        if serology and page_number == pages - 1:
+            y += LINE_HEIGHT
+            fields = {
+                "hiv": rng.choice(["Not Detected", "Non Reactive"]),
+                "hbsag": rng.choice(["Not Detected", "Negative"]),
+                "hbsab": f"{rng.uniform(5, 500):.1f}",
+                "hcv": rng.choice(["Not Detected", "Negative"]),
+                "hbcab": rng.choice(["Non Reactive", "Negative"]),
+            }
+            for text in SEROLOGY_LINES:
+                _line(page, y, text.format(**fields))
+                y += LINE_HEIGHT
+            # Every qualitative value printed above reads as Negative
+            expected_serology.update({
+                "Anti HIV antibody": "Negative",
+                "Hep B antigen (HBsAg)": "Negative",
+                "Hep B antibody (HBsAb)": f"Positive ({fields['hbsab']} IU/L)",
+                "Anti HCV antibody": "Negative",
+                "Hep B Core antibody (HBcAb)": "Negative",
+            })
+
+        for _ in range(filler_lines):
+            if y > PAGE_BOTTOM:
+                break
+            _line(page, y, rng.choice(FILLER_LINES))
+            y += LINE_HEIGHT
+
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return pdf_bytes, expected, expected_serology
+
+
+def make_reports(count, seed=0, **options):
+    return [make_report(seed=seed + i, **options) for i in range(count)]
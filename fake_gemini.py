@@ -0,0 +1,146 @@
+import math
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+# --- Local Gemini Stand-in ---
+# Duck-types the parts of google.generativeai the app uses (configure,
+# list_models, GenerativeModel(...).generate_content with stream=True), so the
+# real ModelResolver / HedgedDispatcher paths run offline with no key or
+# network. Latency, error and 429 rates and response size are configurable:
+#
+#   FakeGemini.from_spec("latency=lognormal:1.5,0.5 rate_limit_rate=0.05 response_chars=3000")
+#
+# Latency is the time to the first chunk; like the real SDK, errors surface
+# when the first chunk is read.
+
+DEFAULT_MODELS = ("models/gemini-1.5-flash", "models/gemini-1.5-pro")
+
+RESPONSE_TEXT = (
+    "**Critical Findings**: Simulated answer from the local Gemini stand-in; no real analysis was made. "
+    "**Key Observations**: Potassium and phosphate are discussed as they would be in a real reply. "
+    "**Dialysis Adequacy Assessment**: KT/V and URR are compared with the usual targets. "
+    "**Clinical Recommendations**: Monitoring, medication review, diet and follow-up tests. "
+    "**Nursing Considerations**: Practical points for the dialysis unit. "
+)
+
+
+class FakeRateLimitError(Exception):
+    # Stands in for google.api_core.exceptions.ResourceExhausted
+    code = 429
+
+
+class FakeServerError(Exception):
+    code = 500
+
+
+def parse_latency(spec):
+    # "const:1.0", "uniform:0.5,2.0", "lognormal:<median s>,<sigma>", "exp:<mean s>" -> sampler(rng)
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "const":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1 / values[0])
+    raise ValueError(f"Unknown latency distribution: {spec!r}")
+
+
+class FakeGemini:
+    def __init__(self, latency="lognormal:1.0,0.5", error_rate=0.0, rate_limit_rate=0.0,
+                 response_chars=2000, chunk_chars=80, chunk_delay=0.02, models=DEFAULT_MODELS, seed=None):
+        self.latency = latency
+        self.sample_latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.response_chars = response_chars
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+        self.models = list(models)
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_spec(cls, spec):
+        # "key=value" pairs separated by spaces or semicolons; models is a comma-separated list
+        options = {}
+        for item in spec.replace(";", " ").split():
+            key, _, value = item.partition("=")
+            if key == "models":
+                options[key] = value.split(",")
+            elif key == "latency":
+                options[key] = value
+            elif key in ("response_chars", "chunk_chars", "seed"):
+                options[key] = int(value)
+            else:
+                options[key] = float(value)
+        return cls(**options)
+
+    def configure(self, **kwargs):
+        pass
+
+    def list_models(self):
+        return [SimpleNamespace(name=name, supported_generation_methods=["generateContent"]) for name in self.models]
+
+    def GenerativeModel(self, model_name):
+        return _FakeModel(self, model_name)
+
+    def _draw(self):
+        # (latency, exception or None) for one call; one lock so a seed replays the same run
+        with self._lock:
+            self.calls += 1
+            latency = self.sample_latency(self._rng)
+            roll = self._rng.random()
+            if roll < self.rate_limit_rate:
+                self.rate_limited += 1
+                return latency * 0.1, FakeRateLimitError("429 Resource has been exhausted (e.g. check quota).")
+            if roll < self.rate_limit_rate + self.error_rate:
+                self.errors += 1
+                return latency, FakeServerError("500 An internal error has occurred.")
+            return latency, None
+
+    def response_text(self):
+        repeats = self.response_chars // len(RESPONSE_TEXT) + 1
+        return (RESPONSE_TEXT * repeats)[:self.response_chars]
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "errors": self.errors, "rate_limited": self.rate_limited}
+
+
+class _FakeModel:
+    def __init__(self, sdk, model_name):
+        self.sdk = sdk
+        self.model_name = model_name
+
+    def generate_content(self, prompt, stream=False, request_options=None):
+        latency, error = self.sdk._draw()
+        timeout = (request_options or {}).get("timeout")
+        chunks = self._chunks(prompt, latency, error, timeout)
+        if stream:
+            return chunks
+        parts = list(chunks)
+        return SimpleNamespace(text="".join(c.text for c in parts), usage_metadata=parts[-1].usage_metadata)
+
+    def _chunks(self, prompt, latency, error, timeout):
+        if timeout and latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Deadline of {timeout}s exceeded")
+        time.sleep(latency)
+        if error:
+            raise error
+        text = self.sdk.response_text()
+        size = self.sdk.chunk_chars
+        for i in range(0, len(text), size):
+            if i:
+                time.sleep(self.sdk.chunk_delay)
+            last = i + size >= len(text)
+            usage = SimpleNamespace(prompt_token_count=(len(prompt) + 3) // 4, candidates_token_count=(len(text) + 3) // 4) if last else None
+            yield SimpleNamespace(text=text[i:i + size], usage_metadata=usage)
@@ -0,0 +1,586 @@
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from types import MappingProxyType
+from metrics import span
+
+# Bump whenever extraction output changes, so cached parses are not reused
+PARSER_VERSION = "10"
+
+# --- 检查项目 ---
+items_info = {
+    "Creatinine": ("µmol/L", 44, 110),
+    "Uric Acid":("µmol/L", 120, 420),
+    "Urea": ("mmol/L", 3.0, 9.0),
+    "Potassium": ("mmol/L", 3.5, 5.1),
+    "Sodium": ("mmol/L", 135, 145),
+    "Albumin": ("g/L", 35, 50),
+    "Bilirubin": ("µmol/L", None, None),
+    "Calcium": ("mmol/L", 2.10, 2.55),
+    "Corrected Calcium": ("mmol/L", 2.10, 2.55),
+    "Phosphate": ("mmol/L", 0.65, 1.45),
+    "Alkaline Phosphatase": ("U/L", 40, 130),
+    "AST": ("U/L", None, None),
+    "ALT": ("U/L", None, None),
+    "Haemoglobin": ("g/L", 120, 150),
+    "White Cell Count": ("µl", None, None),
+    "Hypochromic cells": ("%", None, None),
+    "Platelets": ("10^9/L", 150, 410),
+    "Glucose": ("mmol/L", 3.9, 7.7),
+    "Total Protein": ("g/L", None, None),
+    "HbA1C": ("%", None, None),
+    "Serum Iron": ("µmol/L", 9.0, 26.0),
+    "Sr. UIBC": ("µmol/L", None, None),
+    "Total Iron Binding Capacity": ("µmol/L", None, None),
+    "Saturation": ("%", 13, 51),
+    "Ferritin": ("µg/L", None, None),
+    "Total Chol": ("mmol/L", None, None),
+    "Triglyceride": ("mmol/L", None, None),
+    "LDL-C L": ("mmol/L", None, None),
+    "HDL-C": ("mmol/L", None, None),
+    "Intact Parathyroid Hormone": ("pmol/L", 1.6, 6.9),
+    "Lymphocytes": ("HSD/CU mm", 1.0, 4.0),
+    "Urea - Post Dialysis": ("mmol/L", 3.0, 9.0),
+    "GGT": ("U/L", None, None),
+}
+
+aliases = {
+    "Urea": ["Blood Urea", "Urea (BUN)"],
+    "Urea - Post Dialysis": ["Postdialysis Urea", "Post BUN"],
+    "Sr. Creatinine": ["Creatinine", "Serum Creatinine"],
+    "ALT": ["谷草转氨基酶", "ALT/SGPT (U/L)","A L T"],
+    "AST": ["谷丙转氨基酶", "AST/SGOT (U/L)","A S T"],
+}
+
+reverse_alias = {}
+for key, alist in aliases.items():
+    for alias in alist:
+        reverse_alias.setdefault(alias, []).append(key)
+
+# --- 单位换算 ---
+# Unit spellings recognised right after a value (lowercase) -> canonical spelling
+unit_spellings = {
+    "g/l": "g/L", "g/dl": "g/dL",
+    "mg/dl": "mg/dL", "mg/l": "mg/L",
+    "mmol/l": "mmol/L", "umol/l": "µmol/L", "µmol/l": "µmol/L", "μmol/l": "µmol/L",
+    "ug/dl": "µg/dL", "µg/dl": "µg/dL", "μg/dl": "µg/dL",
+    "ug/l": "µg/L", "µg/l": "µg/L", "μg/l": "µg/L", "ng/ml": "ng/mL",
+    "pg/ml": "pg/mL", "pmol/l": "pmol/L",
+    "u/l": "U/L", "iu/l": "U/L",
+    "%": "%",
+}
+
+# test -> {reported unit: factor to its items_info unit}; the items_info unit is always 1.
+# Urea in mg/dL is read as BUN (urea nitrogen), as US labs report it.
+unit_conversions = {
+    "Creatinine": {"mg/dL": 88.42},
+    "Uric Acid": {"mg/dL": 59.48, "mmol/L": 1000},
+    "Urea": {"mg/dL": 0.357},
+    "Urea - Post Dialysis": {"mg/dL": 0.357},
+    "Albumin": {"g/dL": 10},
+    "Total Protein": {"g/dL": 10},
+    "Bilirubin": {"mg/dL": 17.1},
+    "Calcium": {"mg/dL": 0.2495},
+    "Corrected Calcium": {"mg/dL": 0.2495},
+    "Phosphate": {"mg/dL": 0.3229},
+    "Haemoglobin": {"g/dL": 10},
+    "Glucose": {"mg/dL": 0.0555},
+    "Serum Iron": {"µg/dL": 0.179},
+    "Sr. UIBC": {"µg/dL": 0.179},
+    "Total Iron Binding Capacity": {"µg/dL": 0.179},
+    "Ferritin": {"ng/mL": 1},
+    "Total Chol": {"mg/dL": 0.02586},
+    "LDL-C L": {"mg/dL": 0.02586},
+    "HDL-C": {"mg/dL": 0.02586},
+    "Triglyceride": {"mg/dL": 0.01129},
+    "Intact Parathyroid Hormone": {"pg/mL": 0.106},
+}
+
+# test -> (threshold, unit): a value printed without a unit and below the
+# threshold is read in that unit. Only where the two scales cannot overlap,
+# e.g. haemoglobin 11.2 (g/dL) vs 112 (g/L).
+implied_units = {
+    "Haemoglobin": (30, "g/dL"),
+    "Albumin": (10, "g/dL"),
+    "Creatinine": (30, "mg/dL"),
+}
+
+# --- 年龄/性别参考范围 ---
+# test -> [(sex, min age, max age, low, high)] replacing the items_info range.
+# sex is "M", "F" or None for both; ages are years, max exclusive, None for
+# open-ended. A rule with an age bound only applies when the age is known,
+# a sex-specific one only when the sex is; later rules win.
+range_rules = {
+    "Haemoglobin": [("M", None, None, 130, 170), ("F", None, None, 120, 150)],
+    "Creatinine": [("M", None, None, 62, 106), ("F", None, None, 44, 80)],
+    "Uric Acid": [("M", None, None, 200, 420), ("F", None, None, 140, 360)],
+    "Alkaline Phosphatase": [(None, 0, 18, 100, 390)],
+}
+
+
+# --- Marker Matcher (built once at import) ---
+# Every test name and alias is lowered and compiled once. Per report the text is
+# lowered a single time and each keyword is located with str.find on that copy,
+# which stops at the first hit; in CPython this is several times faster than one
+# combined IGNORECASE alternation or a regex search per marker.
+class MarkerMatcher:
+    value_pattern = re.compile(r"\D*([\d.]+)")
+
+    def __init__(self, items, alias_map, units=unit_spellings):
+        self.items = items
+        self.units = units
+        spellings = "|".join(re.escape(u) for u in sorted(units, key=len, reverse=True))
+        # A known unit directly after the value (past an optional "*" flag)
+        self.unit_pattern = re.compile(rf"\s*\*?\s*({spellings})(?![\w/])", re.IGNORECASE)
+        # item -> search terms in priority order (name first, then aliases)
+        self.terms = {}
+        for item in items:
+            terms = [item] + alias_map.get(item, []) + reverse_alias.get(item, [])
+            self.terms[item] = [t.lower() for t in dict.fromkeys(terms)]
+
+        self.keywords = list(dict.fromkeys(t for terms in self.terms.values() for t in terms))
+        self.keyword_patterns = {k: re.compile(re.escape(k), re.IGNORECASE) for k in self.keywords}
+        # Whole words only, for table rows: "ast" must not match inside "Fasting".
+        # Edges that are not Latin letters or digits (CJK names, "K+") need no boundary.
+        self.word_patterns = {
+            k: re.compile(
+                ("(?<![a-z0-9])" if k[:1].isascii() and k[:1].isalnum() else "")
+                + re.escape(k)
+                + ("(?![a-z0-9])" if k[-1:].isascii() and k[-1:].isalnum() else ""),
+                re.IGNORECASE,
+            )
+            for k in self.keywords
+        }
+
+    # keyword -> start of its first occurrence
+    def _positions(self, text):
+        lowered = text.lower()
+        if len(lowered) == len(text):
+            positions = {k: lowered.find(k) for k in self.keywords}
+            return {k: pos for k, pos in positions.items() if pos >= 0}
+        # lowering changed offsets (rare unicode), fall back to regex search
+        positions = {}
+        for keyword, pattern in self.keyword_patterns.items():
+            match = pattern.search(text)
+            if match:
+                positions[keyword] = match.start()
+        return positions
+
+    def normalize_unit(self, text):
+        # "mg/dl", "umol/L" -> "mg/dL", "µmol/L"; "" when not a known unit
+        return self.units.get(text.lower(), "")
+
+    # keyword -> (value string, unit), for the first occurrence of each keyword
+    # followed by a number; unit is "" when none is printed right after it
+    def find_values(self, text):
+        values = {}
+        for keyword, pos in self._positions(text).items():
+            # if no number follows the first occurrence, none follows a later one either
+            match = self.value_pattern.match(text, pos + len(keyword))
+            if match:
+                unit = self.unit_pattern.match(text, match.end())
+                values[keyword] = (match.group(1), self.normalize_unit(unit.group(1)) if unit else "")
+        return values
+
+    # Builds (test, value, unit) readings, as printed, from keyword -> (value string, unit).
+    # Tests not in the report are left out; a value that is not a number is NaN.
+    # Flags, ranges and unit conversion are lab_results.lab_table's job.
+    def to_readings(self, values):
+        readings = []
+        for item in self.items:
+            found = next((values[t] for t in self.terms[item] if t in values), None)
+            if found is None:
+                continue
+            raw_value, unit = found
+            try:
+                value = float(raw_value)
+            except ValueError:
+                value = float("nan")
+            readings.append((item, value, unit))
+        return readings
+
+    def extract(self, text):
+        return self.to_readings(self.find_values(text))
+
+
+marker_matcher = MarkerMatcher(items_info, aliases)
+
+
+def extract_lab_results(text):
+    return marker_matcher.extract(text)
+
+
+# --- Extract Patient Info from PDF ---
+def extract_patient_info(text):
+    info = {"age": 0, "sex": "", "name": "", "id": ""}
+    
+    age_patterns = [
+        r"Age[:\s]+(\d{1,3})",
+        r"Age[:\s]+(\d{1,3})\s*(?:years|yrs|y)",
+        r"(\d{1,3})\s*(?:years old|yrs old|y/o)",
+        r"DOB.*?Age[:\s]+(\d{1,3})",
+    ]
+    for pattern in age_patterns:
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            age = int(match.group(1))
+            if 0 < age < 120:
+                info["age"] = age
+                break
+    
+    # "M" / "F", selects sex-specific reference ranges
+    sex_patterns = [
+        r"(?:Sex|Gender)[:\s]+(Male|Female|M|F)\b",
+        r"Age\s*/\s*Sex[:\s]+\d{1,3}\s*(?:years|yrs|y)?\s*/\s*(Male|Female|M|F)\b",
+    ]
+    for pattern in sex_patterns:
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            info["sex"] = match.group(1)[0].upper()
+            break
+    
+    name_patterns = [
+        r"Patient Name[:\s]+([A-Z][a-zA-Z\s]+?)(?:\n|(?:Age|Sex|Gender|DOB|ID|MRN))",
+        r"Name[:\s]+([A-Z][a-zA-Z\s]+?)(?:\n|(?:Age|Sex|Gender|DOB|ID|MRN))",
+    ]
+    for pattern in name_patterns:
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            info["name"] = match.group(1).strip()
+            break
+    
+    # Case-sensitive whole words, so "Lipid Profile" or "Uric Acid 350" is not an ID
+    id_patterns = [
+        r"\b(?:Patient\s+I[Dd]|MRN|Medical\s+Record(?:\s+No\.?)?)[:\s]+([A-Z0-9][A-Z0-9-]*)\b",
+        r"\b(?:Patient\s+)?ID\b[:\s]+([A-Z0-9][A-Z0-9-]*)\b",
+    ]
+    for pattern in id_patterns:
+        match = re.search(pattern, text)
+        if match:
+            info["id"] = match.group(1).strip()
+            break
+    
+    return info
+
+
+# --- Extract Report Date (ISO yyyy-mm-dd, "" if not found) ---
+def extract_report_date(text):
+    date_patterns = [
+        r"(?:Report(?:ed)? Date|Date Reported|Collect(?:ed|ion) Date|Date Collected|Sample Date|Date)[:\s]+(\d{1,2}[/-]\d{1,2}[/-]\d{4}|\d{4}-\d{2}-\d{2}|\d{1,2}\s+[A-Za-z]{3,9}\s+\d{4})",
+    ]
+    date_formats = ["%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%d %b %Y", "%d %B %Y"]
+    for pattern in date_patterns:
+        for match in re.finditer(pattern, text, re.IGNORECASE):
+            value = " ".join(match.group(1).split())
+            for fmt in date_formats:
+                try:
+                    return datetime.strptime(value, fmt).date().isoformat()
+                except ValueError:
+                    continue
+    return ""
+
+
+# --- Serology Data Extraction ---
+def interpret_result(text):
+    if any(word in text.lower() for word in ["not detected", "negative", "non reactive", "non-reactive"]):
+        return "Negative"
+    elif any(word in text.lower() for word in ["detected", "positive", "reactive"]):
+        return "Positive"
+    else:
+        return "Not done"
+
+
+# Result tokens; longer phrases first so "Not Detected" never reads as "Detected"
+QUALITATIVE_TOKEN = r"Not Detected|Non[- ]Reactive|Negative|Positive|Detected|Reactive"
+QUANTITATIVE_TOKEN = r"(\d+(?:\.\d+)?)\s*(?:m?IU/m?L)"
+
+# --- 血清学项目 ---
+# name -> (anchors, kind). "qualitative" reads Negative/Positive, "quantitative"
+# reads a titre and reports "Positive (<n> IU/L)". Anchors are regex fragments
+# starting with a literal letter, matched case-insensitively; a test is
+# "Not done" when no anchor has a result.
+serology_info = {
+    "Anti HIV antibody": ([r"HIV"], "qualitative"),
+    "Hep B antigen (HBsAg)": ([r"Hepatitis B Surface antigen", r"HBsAg"], "qualitative"),
+    "Hep B antibody (HBsAb)": ([r"Hepatitis B Surface antibody", r"Anti[- ]?HBs\b", r"HBsAb"], "quantitative"),
+    "Anti HCV antibody": ([r"Hepatitis C antibody", r"Anti[- ]?HCV", r"HCV antibody"], "qualitative"),
+    "Hep B Core antibody (HBcAb)": ([r"Hepatitis B core antibody", r"Anti[- ]?HBc\b", r"HBcAb"], "qualitative"),
+    "Syphilis (VDRL/TPHA)": ([r"Syphilis", r"VDRL", r"TPHA", r"RPR"], "qualitative"),
+}
+
+
+# --- Serology Matcher (built once at import) ---
+# All anchors are compiled into one alternation and found in a single finditer
+# pass. Each anchor's result must appear within `window` characters after it
+# and before the next anchor, so a missing result costs a bounded search
+# instead of a scan to the end of the report, and a result is never borrowed
+# from a neighbouring test. The first anchor occurrence with a result wins.
+class SerologyMatcher:
+    def __init__(self, tests, window=120):
+        self.tests = tests
+        self.window = window
+        self.groups = {}  # regex group name -> test
+        alternatives = []
+        for index, (name, (anchors, kind)) in enumerate(tests.items()):
+            group = f"t{index}"
+            self.groups[group] = name
+            alternatives.append(f"(?P<{group}>{'|'.join(anchors)})")
+        # Leading lookahead on the anchors' first letters lets re skip most positions quickly
+        first_letters = "".join(sorted({a[0].lower() for anchors, _ in tests.values() for a in anchors}))
+        self.anchor_pattern = re.compile(f"(?=[{first_letters}])(?:{'|'.join(alternatives)})", re.IGNORECASE)
+        self.token_patterns = {
+            name: re.compile(QUANTITATIVE_TOKEN if kind == "quantitative" else QUALITATIVE_TOKEN, re.IGNORECASE)
+            for name, (anchors, kind) in tests.items()
+        }
+
+    # test -> (formatted result, end offset of the result token)
+    def find_results(self, text):
+        anchors = [(m.lastgroup, m.end(), m.start()) for m in self.anchor_pattern.finditer(text)]
+        found = {}
+        for i, (group, end, _) in enumerate(anchors):
+            name = self.groups[group]
+            if name in found:
+                continue
+            limit = min(end + self.window, anchors[i + 1][2] if i + 1 < len(anchors) else len(text))
+            match = self.token_patterns[name].search(text, end, limit)
+            if match:
+                found[name] = (self._format(name, match), match.end())
+        return found
+
+    def _format(self, name, match):
+        if self.tests[name][1] == "quantitative":
+            return f"Positive ({match.group(1)} IU/L)"
+        return interpret_result(match.group(0))
+
+    def extract(self, text):
+        found = self.find_results(text)
+        return {name: found[name][0] if name in found else "Not done" for name in self.tests}
+
+
+serology_matcher = SerologyMatcher(serology_info)
+
+
+def extract_serology(text):
+    return serology_matcher.extract(text)
+
+
+# --- Incremental Report Scanner ---
+# Pages are fed one at a time; `complete` turns True once every tracked marker
+# and serology field is settled, i.e. later pages can no longer change what
+# extract_lab_results / extract_serology return. Only the new page plus a short
+# tail of the previous one is searched, so total work is linear in the text.
+class ReportScanner:
+    tail_length = 64
+
+    def __init__(self, matcher=marker_matcher, serology=serology_matcher):
+        self.matcher = matcher
+        self.serology = serology
+        self.parts = []
+        self.length = 0
+        self.pages_read = 0
+        self.tail = ""
+        # Only each item's first-priority term decides whether it can still change
+        self.unseen_markers = {terms[0] for terms in matcher.terms.values()}
+        self.open_markers = {}  # keyword -> global end offset, number not closed yet
+        self.unsettled_serology = set(serology.tests)
+        # Long enough to hold an anchor and its whole result window
+        self.serology_tail = ""
+
+    @property
+    def complete(self):
+        return not (self.unseen_markers or self.open_markers or self.unsettled_serology)
+
+    def text(self):
+        return "".join(self.parts)
+
+    def _value_closed(self, window, start):
+        # The number after a marker is settled once a non-number character follows it
+        match = self.matcher.value_pattern.match(window, start)
+        return bool(match) and match.end() < len(window) and any(c.isdigit() for c in match.group(1))
+
+    def feed(self, page_text):
+        self.pages_read += 1
+        if not page_text:
+            return
+        self.parts.append(page_text)
+        window = self.tail + page_text
+        window_start = self.length - len(self.tail)
+        self.length += len(page_text)
+        self.tail = window[-self.tail_length:]
+
+        lowered = window.lower()
+        if len(lowered) != len(window):
+            lowered = None
+        for keyword in list(self.unseen_markers):
+            if lowered is not None:
+                pos = lowered.find(keyword)
+            else:
+                match = self.matcher.keyword_patterns[keyword].search(window)
+                pos = match.start() if match else -1
+            if pos >= 0:
+                self.unseen_markers.discard(keyword)
+                self.open_markers[keyword] = window_start + pos + len(keyword)
+        for keyword, end in list(self.open_markers.items()):
+            if self._value_closed(window, max(0, end - window_start)):
+                del self.open_markers[keyword]
+
+        if self.unsettled_serology:
+            serology_window = self.serology_tail + page_text
+            self.serology_tail = serology_window[-(self.serology.window + self.tail_length):]
+            for name, (_, end) in self.serology.find_results(serology_window).items():
+                # A result touching the end of the text may still continue on the next page
+                if end < len(serology_window):
+                    self.unsettled_serology.discard(name)
+
+
+# --- Layout-aware Extraction (PyMuPDF word coordinates) ---
+# Instead of the flattened text, words are bucketed into table rows by their
+# vertical centre and each test name takes the first numeric cell to its right
+# in its own row, so reference ranges, dates and neighbouring rows are not
+# picked up by mistake. Sorting the words dominates: O(words log words).
+layout_value_pattern = re.compile(r"[<>]?(\d+(?:\.\d+)?)[*HhLl]?")
+
+
+def group_rows(words, tolerance=None):
+    # words: (x0, y0, x1, y1, text, ...) tuples from page.get_text("words")
+    if not words:
+        return []
+    if tolerance is None:
+        heights = sorted(w[3] - w[1] for w in words)
+        tolerance = heights[len(heights) // 2] / 2
+    rows = []
+    row = []
+    row_centre = None
+    for word in sorted(words, key=lambda w: (w[1] + w[3]) / 2):
+        centre = (word[1] + word[3]) / 2
+        if row and centre - row_centre > tolerance:
+            rows.append(sorted(row, key=lambda w: w[0]))
+            row = []
+        if not row:
+            row_centre = centre
+        row.append(word)
+    rows.append(sorted(row, key=lambda w: w[0]))
+    return rows
+
+
+def find_row_values(row, matcher=marker_matcher):
+    # keyword -> (value string, unit) for one table row; the unit is the cell after the value
+    cells = [w[4] for w in row]
+    starts = []
+    offset = 0
+    for cell in cells:
+        starts.append(offset)
+        offset += len(cell) + 1
+    line = " ".join(cells).lower()
+
+    hits = []
+    for keyword in matcher.keywords:
+        # Cheap substring test first; the word-boundary pattern only runs on candidates
+        if keyword in line:
+            match = matcher.word_patterns[keyword].search(line)
+            if match:
+                hits.append((match.start(), match.end(), keyword))
+    # "Calcium" inside "Corrected Calcium" or "Urea" inside "Urea - Post Dialysis" belongs to the longer name
+    hits = [h for h in hits if not any(o[0] <= h[0] and h[1] <= o[1] and (o[1] - o[0]) > (h[1] - h[0]) for o in hits)]
+
+    values = {}
+    for start, end, keyword in hits:
+        for i, (cell_start, cell) in enumerate(zip(starts, cells)):
+            if cell_start < end:
+                continue
+            match = layout_value_pattern.fullmatch(cell)
+            if match:
+                unit = matcher.normalize_unit(cells[i + 1]) if i + 1 < len(cells) else ""
+                values[keyword] = (match.group(1), unit)
+                break
+    return values
+
+
+def extract_lab_results_layout(source, matcher=marker_matcher):
+    values = {}
+    with open_pdf(source) as doc:
+        for page in doc:
+            for row in group_rows(page.get_text("words")):
+                for keyword, value in find_row_values(row, matcher).items():
+                    # First row in reading order wins, like the text extractor
+                    values.setdefault(keyword, value)
+    return matcher.to_readings(values)
+
+
+# --- Full PDF Parse ---
+def open_pdf(source):
+    # source: PDF bytes or a file path.
+    # PyMuPDF is imported on the first PDF, keeping it out of the app's first paint
+    import fitz
+    if isinstance(source, str):
+        return fitz.open(source, filetype="pdf")
+    return fitz.open(stream=source, filetype="pdf")
+
+
+def iter_page_text(doc):
+    # Lazily yields each page's flattened text; pages after an early stop are never loaded
+    for page in doc:
+        yield page.get_text("text").strip().replace("\n", " ")
+
+
+def extract_pdf_text(source, early_stop=True):
+    scanner = ReportScanner()
+    with open_pdf(source) as doc:
+        page_count = doc.page_count
+        for text in iter_page_text(doc):
+            scanner.feed(text)
+            if early_stop and scanner.complete:
+                break
+    return scanner.text(), page_count, scanner.pages_read
+
+
+def parse_report(source, early_stop=True):
+    with span("pdf_extract"):
+        raw_text, page_count, pages_read = extract_pdf_text(source, early_stop)
+    with span("patient_info"):
+        patient_info = extract_patient_info(raw_text)
+        report_date = extract_report_date(raw_text)
+    with span("markers"):
+        results = extract_lab_results(raw_text) if raw_text else []
+    with span("serology"):
+        serology = extract_serology(raw_text) if raw_text else None
+    return {
+        "raw_text": raw_text,
+        "page_count": page_count,
+        "pages_read": pages_read,
+        "patient_info": patient_info,
+        "report_date": report_date,
+        "results": results,
+        "serology": serology,
+    }
+
+
+# --- Parsed Report Snapshot ---
+# Read-only view of one parse_report() result. The app builds it once per
+# uploaded file and every rerun, including fragment reruns, reads the same
+# object; rows are tuples and dicts are mapping proxies so nothing downstream
+# can change it in place.
+@dataclass(frozen=True)
+class ReportSnapshot:
+    file_digest: str
+    raw_text: str
+    page_count: int
+    pages_read: int
+    patient_info: MappingProxyType
+    report_date: str
+    results: tuple
+    serology: MappingProxyType | None
+
+    @classmethod
+    def from_parsed(cls, file_digest, parsed):
+        serology = parsed["serology"]
+        return cls(
+            file_digest=file_digest,
+            raw_text=parsed["raw_text"],
+            page_count=parsed["page_count"],
+            pages_read=parsed["pages_read"],
+            patient_info=MappingProxyType(dict(parsed["patient_info"])),
+            report_date=parsed["report_date"],
+            results=tuple(tuple(row) for row in parsed["results"]),
+            serology=MappingProxyType(dict(serology)) if serology is not None else None,
+        )
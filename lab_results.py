@@ -0,0 +1,234 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from lab_parser import implied_units, items_info, range_rules, unit_conversions
+
+# --- Typed Lab Results (reports × tests) ---
+# The parser gives each report as (test, value, unit) readings, as printed.
+# lab_table() turns any number of reports into one table of NumPy columns:
+# one row per report, one column per items_info test, holding the value in
+# the items_info unit, the age/sex-specific range and an "L"/"H"/"" flag.
+# Unit factors and range bands are compiled into arrays once at import, so
+# converting and flagging a whole batch is a few array operations. A missing
+# bound is NaN and never flags; a bound of 0 is a real bound. A value in a
+# unit with no conversion for its test is kept as printed, unflagged.
+
+TESTS = list(items_info)
+TEST_INDEX = {test: j for j, test in enumerate(TESTS)}
+UNITS = [items_info[test][0] for test in TESTS]
+
+# Cell status
+OK, MISSING, UNPARSED, UNCONVERTED = 0, 1, 2, 3
+STATUS_TEXT = {MISSING: "Not found", UNPARSED: "⚠️ Failed to parse", UNCONVERTED: "⚠️ Unknown unit, shown as printed and not flagged"}
+
+SEX_INDEX = {"M": 1, "F": 2}  # 0: not given
+
+
+def _bound(value):
+    return np.nan if value is None else float(value)
+
+
+# --- Unit Factors: FACTORS[test, unit id] ---
+# Unit ids cover every unit in items_info and the conversion tables, then
+# BLANK (no unit printed, read in the items_info unit) and UNKNOWN (no factor
+# for any test). NaN marks a unit with no conversion for that test.
+UNIT_NAMES = list(dict.fromkeys(
+    UNITS
+    + [unit for units in unit_conversions.values() for unit in units]
+    + [unit for _, unit in implied_units.values()]
+))
+UNIT_ID = {unit: i for i, unit in enumerate(UNIT_NAMES)}
+BLANK, UNKNOWN = len(UNIT_NAMES), len(UNIT_NAMES) + 1
+
+FACTORS = np.full((len(TESTS), len(UNIT_NAMES) + 2), np.nan)
+FACTORS[:, BLANK] = 1.0
+for j, test in enumerate(TESTS):
+    FACTORS[j, UNIT_ID[UNITS[j]]] = 1.0
+    for unit, factor in unit_conversions.get(test, {}).items():
+        FACTORS[j, UNIT_ID[unit]] = factor
+
+IMPLIED_BELOW = np.array([_bound(implied_units[t][0]) if t in implied_units else np.nan for t in TESTS])
+IMPLIED_UNIT = np.array([UNIT_ID[implied_units[t][1]] if t in implied_units else BLANK for t in TESTS])
+
+
+# --- Reference Ranges: LOW/HIGH[test, sex, age band] ---
+# Age bands are the intervals between every age bound in range_rules; the
+# last band is "age not given", where only rules without age bounds apply.
+AGE_EDGES = np.array(sorted({float(age) for rules in range_rules.values() for rule in rules for age in rule[1:3] if age is not None}))
+UNKNOWN_AGE = len(AGE_EDGES) + 1
+
+
+def _compile_ranges():
+    low = np.empty((len(TESTS), 3, UNKNOWN_AGE + 1))
+    high = np.empty_like(low)
+    for j, test in enumerate(TESTS):
+        low[j], high[j] = _bound(items_info[test][1]), _bound(items_info[test][2])
+
+    band_lower = np.concatenate([[-np.inf], AGE_EDGES])
+    band_upper = np.concatenate([AGE_EDGES, [np.inf]])
+    for test, rules in range_rules.items():
+        j = TEST_INDEX[test]
+        for sex, min_age, max_age, rule_low, rule_high in rules:
+            sexes = [SEX_INDEX[sex]] if sex else [0, 1, 2]
+            lower = -np.inf if min_age is None else min_age
+            upper = np.inf if max_age is None else max_age
+            bands = list(np.flatnonzero((band_lower >= lower) & (band_upper <= upper)))
+            if min_age is None and max_age is None:
+                bands.append(UNKNOWN_AGE)
+            low[j][np.ix_(sexes, bands)] = _bound(rule_low)
+            high[j][np.ix_(sexes, bands)] = _bound(rule_high)
+    return low, high
+
+
+LOW, HIGH = _compile_ranges()
+
+
+def range_text(low, high):
+    if np.isnan(low) and np.isnan(high):
+        return "-"
+    if np.isnan(high):
+        return f"≥ {low:g}"
+    if np.isnan(low):
+        return f"≤ {high:g}"
+    return f"{low:g}-{high:g}"
+
+
+def format_value(value):
+    return f"{round(float(value), 2):g}"
+
+
+# Arrays are (reports, tests); `reported` / `reported_unit` / `printed_unit`
+# are the value, unit id and unit text as printed, `value` is in the
+# items_info unit (NaN when the unit could not be converted)
+@dataclass(frozen=True, eq=False)
+class LabTable:
+    reported: np.ndarray
+    reported_unit: np.ndarray
+    printed_unit: np.ndarray
+    unit_inferred: np.ndarray
+    value: np.ndarray
+    low: np.ndarray
+    high: np.ndarray
+    flag: np.ndarray
+    status: np.ndarray
+
+    tests = TESTS
+    units = UNITS
+
+    def __post_init__(self):
+        for array in (self.reported, self.reported_unit, self.printed_unit, self.unit_inferred, self.value, self.low, self.high, self.flag, self.status):
+            array.setflags(write=False)
+
+    def __len__(self):
+        return len(self.value)
+
+    @property
+    def abnormal(self):
+        return self.flag != ""
+
+    def column(self, test):
+        # The test's values across all reports
+        return self.value[:, TEST_INDEX[test]]
+
+    def get(self, test, report=0):
+        return float(self.value[report, TEST_INDEX[test]])
+
+    def shown(self, report=0):
+        # (values, units, reference ranges) as displayed: converted values in the
+        # items_info unit, unconverted ones as printed with no range
+        unconverted = self.status[report] == UNCONVERTED
+        values = np.where(unconverted, self.reported[report], self.value[report])
+        units = np.where(unconverted, self.printed_unit[report], UNITS)
+        ranges = ["-" if raw else range_text(lo, hi) for raw, lo, hi in zip(unconverted, self.low[report], self.high[report])]
+        return values, units, ranges
+
+    # (test, value, unit, reference range, flag) for each test read from one report
+    def records(self, report=0, converted_only=False):
+        # Unconverted rows are in their printed unit; converted_only drops them
+        # for anything that compares values across reports
+        values, units, ranges = self.shown(report)
+        kept = (OK,) if converted_only else (OK, UNCONVERTED)
+        return [
+            (test, float(values[j]), str(units[j]), ranges[j], str(self.flag[report, j]))
+            for j, test in enumerate(TESTS)
+            if self.status[report, j] in kept
+        ]
+
+    def missing_count(self, report=0):
+        return int(np.count_nonzero(np.isin(self.status[report], (MISSING, UNPARSED))))
+
+    def notes(self, report=0):
+        # Why a cell has no value, or what it was converted from
+        notes = []
+        for j in range(len(TESTS)):
+            status, unit = self.status[report, j], self.reported_unit[report, j]
+            if status != OK:
+                notes.append(STATUS_TEXT[status])
+            elif unit != BLANK and FACTORS[j, unit] != 1.0:
+                how = "read as" if self.unit_inferred[report, j] else "from"
+                notes.append(f"{how} {format_value(self.reported[report, j])} {UNIT_NAMES[unit]}")
+            else:
+                notes.append("")
+        return notes
+
+    def frame(self, report=0):
+        # One report as the app shows it: Test, Value, Unit, Reference Range, Flag, Note
+        import pandas as pd
+        values, units, ranges = self.shown(report)
+        return pd.DataFrame({
+            "Test": TESTS,
+            "Value": values,
+            "Unit": units,
+            "Reference Range": ranges,
+            "Flag": self.flag[report],
+            "Note": self.notes(report),
+        })
+
+    def wide(self):
+        # One row per report, one numeric column per test, plus an "Abnormal" summary column
+        import pandas as pd
+        table = pd.DataFrame(self.value, columns=TESTS)
+        table["Abnormal"] = [
+            ", ".join(f"{TESTS[j]} {self.flag[i, j]}" for j in np.flatnonzero(row))
+            for i, row in enumerate(self.abnormal)
+        ]
+        return table
+
+
+# readings: one sequence of (test, value, unit) per report. ages (years, 0 or
+# None when unknown) and sexes ("M", "F" or "") are per report or one for all.
+def lab_table(readings, ages=0, sexes=""):
+    readings = list(readings)
+    shape = (len(readings), len(TESTS))
+    reported = np.full(shape, np.nan)
+    unit = np.full(shape, BLANK)
+    printed = np.full(shape, "", dtype=object)
+    present = np.zeros(shape, dtype=bool)
+    for i, rows in enumerate(readings):
+        for test, value, printed_unit in rows:
+            j = TEST_INDEX.get(test)
+            if j is not None:
+                reported[i, j] = value
+                unit[i, j] = UNIT_ID.get(printed_unit, UNKNOWN) if printed_unit else BLANK
+                printed[i, j] = printed_unit or ""
+                present[i, j] = True
+
+    with np.errstate(invalid="ignore"):
+        inferred = (unit == BLANK) & (reported < IMPLIED_BELOW)
+        unit = np.where(inferred, IMPLIED_UNIT, unit)
+        factor = FACTORS[np.arange(shape[1]), unit]
+        value = reported * factor
+
+        ages = np.broadcast_to(np.asarray(ages, dtype=float), shape[:1])
+        band = np.where(ages > 0, np.searchsorted(AGE_EDGES, ages, side="right"), UNKNOWN_AGE)
+        sex = np.array([SEX_INDEX.get(s, 0) for s in np.broadcast_to(np.asarray(sexes, dtype=object), shape[:1])], dtype=int)
+        low = LOW[np.arange(shape[1]), sex[:, None], band[:, None]]
+        high = HIGH[np.arange(shape[1]), sex[:, None], band[:, None]]
+        flag = np.where(value < low, "L", np.where(value > high, "H", ""))
+
+    status = np.select([~present, np.isnan(reported), np.isnan(factor)], [MISSING, UNPARSED, UNCONVERTED], OK)
+    return LabTable(
+        reported=reported, reported_unit=unit, printed_unit=printed, unit_inferred=inferred, value=value,
+        low=low, high=high, flag=flag, status=status,
+    )
@@ -0,0 +1,209 @@
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# METRICS_ENABLED=0 turns every span into a no-op. METRICS_EXPORT="json" logs
+# one JSON line per span; "prometheus" also rewrites METRICS_PROM_PATH (a
+# node_exporter textfile) at most every METRICS_PROM_INTERVAL seconds.
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+METRICS_EXPORT = os.environ.get("METRICS_EXPORT", "")
+METRICS_PROM_PATH = os.environ.get("METRICS_PROM_PATH", os.path.join(".cache", "metrics.prom"))
+METRICS_PROM_INTERVAL = float(os.environ.get("METRICS_PROM_INTERVAL", "15"))
+
+# Histogram bucket upper bounds in seconds (Prometheus "le"), 1 ms to 2 min
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+logger = logging.getLogger("lab_report.metrics")
+if METRICS_EXPORT == "json" and not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+
+# --- Histogram ---
+# Cumulative-style bucket counts for export plus a bounded window of recent
+# samples for the percentiles shown in the app. observe() is O(log buckets).
+class Histogram:
+    def __init__(self, buckets=BUCKETS, window=1024):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def percentile(self, p):
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+# --- Metrics Registry (one per process) ---
+# Span durations go into one histogram per (stage, labels); counters hold
+# totals such as Gemini token counts. All updates take one lock.
+class MetricsRegistry:
+    def __init__(self, enabled=METRICS_ENABLED, export=METRICS_EXPORT, prom_path=METRICS_PROM_PATH, prom_interval=METRICS_PROM_INTERVAL):
+        self.enabled = enabled
+        self.export = export
+        self.prom_path = prom_path
+        self.prom_interval = prom_interval
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._next_prom_write = 0.0
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def observe(self, stage, seconds, **labels):
+        if not self.enabled:
+            return
+        key = self._key(stage, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+        if self.export:
+            self._export(stage, seconds, labels)
+
+    def increment(self, name, amount=1, **labels):
+        if not self.enabled or not amount:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def span(self, stage, **labels):
+        # with registry.span("markers"): ...  (shared no-op context when disabled)
+        if not self.enabled:
+            return _NOOP_SPAN
+        return self._span(stage, labels)
+
+    @contextmanager
+    def _span(self, stage, labels):
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            if error:
+                labels = dict(labels, error=error)
+            self.observe(stage, time.perf_counter() - start, **labels)
+
+    def _export(self, stage, seconds, labels):
+        if self.export == "json":
+            logger.info(json.dumps({"event": "span", "stage": stage, "seconds": round(seconds, 6), **labels}))
+        elif self.export == "prometheus":
+            # One thread claims each write slot; the others skip this interval
+            with self._lock:
+                now = time.monotonic()
+                if now < self._next_prom_write:
+                    return
+                self._next_prom_write = now + self.prom_interval
+            try:
+                self.write_prometheus(self.prom_path)
+            except Exception:
+                # Runs inside span exits: a failed export must never fail the stage it timed
+                logger.warning("Writing metrics to %s failed", self.prom_path, exc_info=True)
+
+    def snapshot(self):
+        # [{stage, labels, count, total_s, p50_ms, p95_ms, max_ms}] and {counter: value}
+        with self._lock:
+            rows = []
+            for (stage, labels), h in sorted(self._histograms.items()):
+                rows.append({
+                    "stage": stage,
+                    "labels": ", ".join(f"{k}={v}" for k, v in labels),
+                    "count": h.count,
+                    "total_s": round(h.sum, 3),
+                    "p50_ms": round(h.percentile(50) * 1000, 2),
+                    "p95_ms": round(h.percentile(95) * 1000, 2),
+                    "max_ms": round(max(h.recent) * 1000, 2),
+                })
+            counters = {
+                name + ("{" + ", ".join(f"{k}={v}" for k, v in labels) + "}" if labels else ""): value
+                for (name, labels), value in sorted(self._counters.items())
+            }
+        return rows, counters
+
+    def prometheus_text(self, prefix="lab_report"):
+        def label_text(labels, extra=()):
+            pairs = [f'{k}="{v}"' for k, v in tuple(labels) + tuple(extra)]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent in each app stage.",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        with self._lock:
+            for (stage, labels), h in sorted(self._histograms.items()):
+                labels = (("stage", stage),) + labels
+                cumulative = 0
+                for bound, count in zip([str(b) for b in h.buckets] + ["+Inf"], h.counts):
+                    cumulative += count
+                    lines.append(f"{prefix}_stage_seconds_bucket{label_text(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{prefix}_stage_seconds_sum{label_text(labels)} {h.sum}")
+                lines.append(f"{prefix}_stage_seconds_count{label_text(labels)} {h.count}")
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE {prefix}_{name} counter")
+                for (counter, labels), value in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append(f"{prefix}_{name}{label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Write then rename, so a scraper never reads a half-written file; the
+        # temp name is unique, so concurrent writers never share one
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory or ".", prefix=os.path.basename(path) + ".", suffix=".tmp", delete=False) as f:
+            f.write(self.prometheus_text())
+        try:
+            # NamedTemporaryFile is owner-only; the textfile collector must be able to read it
+            os.chmod(f.name, 0o644)
+            os.replace(f.name, path)
+        except OSError:
+            os.remove(f.name)
+            raise
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+# Process-wide registry used by the parser, the AI client and the app
+registry = MetricsRegistry()
+
+
+def span(stage, **labels):
+    return registry.span(stage, **labels)
@@ -0,0 +1,185 @@
+import re
+
+# Rough budgets in tokens (~4 characters each, Gemini's own rule of thumb for
+# English); counting exactly would need a count_tokens round trip per prompt
+CONTEXT_TOKEN_BUDGET = 800
+HISTORY_TOKEN_BUDGET = 1200
+SUMMARY_TOKEN_BUDGET = 300
+
+
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+
+def _truncate(text, max_tokens):
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(" ", 1)[0]
+    return cut + " …"
+
+
+# --- Compact Lab Lines ---
+# One short line per found value, abnormal values first:
+#   "Potassium 6.1 mmol/L H (3.5-5.1)" / "Sodium 139.0 mmol/L"
+# Tests that were not found are counted, not listed. `results` is a
+# lab_results.LabTable; values, units and flags are already normalised there.
+def lab_lines(results, report=0):
+    abnormal, normal = [], []
+    for test, value, unit, ref, flag in results.records(report):
+        line = f"{test} {round(value, 2):g} {unit}".rstrip()
+        if flag:
+            abnormal.append(f"{line} {flag} ({ref})" if ref != "-" else f"{line} {flag}")
+        else:
+            normal.append(line)
+    return abnormal, normal, results.missing_count(report)
+
+
+def serology_lines(serology):
+    if not serology:
+        return ["No serology data"]
+    done = [f"{test}: {result}" for test, result in serology.items() if result != "Not done"]
+    not_done = [test for test, result in serology.items() if result == "Not done"]
+    if not_done:
+        done.append(f"Not done: {', '.join(not_done)}")
+    return done
+
+
+# --- Analysis Context ---
+# Replaces the full results table with compact lines. If the context is over
+# `budget`, normal values are dropped from the end (abnormal ones always stay).
+def build_context(results, serology, kt_v, URR, patient_age, patient_conditions, current_medications,
+                  dialysis_time, uf_volume, post_weight, budget=CONTEXT_TOKEN_BUDGET):
+    abnormal, normal, missing = lab_lines(results)
+
+    def render(normal_shown):
+        lines = [
+            "Patient Context:",
+            f"- Age: {patient_age if patient_age > 0 else 'Not provided'}",
+            f"- Known Conditions: {patient_conditions if patient_conditions else 'None specified'}",
+            f"- Current Medications: {current_medications if current_medications else 'None specified'}",
+            "",
+            "Abnormal Lab Results (H = high, L = low, reference range in brackets):",
+            *(abnormal or ["None"]),
+            "",
+            "Normal Lab Results:",
+            *(normal[:normal_shown] or ["None"]),
+        ]
+        omitted = len(normal) - normal_shown
+        if omitted:
+            lines.append(f"(+{omitted} more within range, omitted)")
+        if missing:
+            lines.append(f"({missing} tests not in this report)")
+        lines += [
+            "",
+            "Serology Results:",
+            *serology_lines(serology),
+            "",
+            "Dialysis Adequacy:",
+            f"KT/V: {kt_v}, URR: {URR}%" if kt_v and URR else "KT/V and URR not calculated",
+            f"- Dialysis Time: {dialysis_time} hours, Ultrafiltration: {uf_volume} L, Post-dialysis Weight: {post_weight} kg",
+        ]
+        return "\n".join(lines)
+
+    shown = len(normal)
+    context = render(shown)
+    while shown and estimate_tokens(context) > budget:
+        shown -= 1
+        context = render(shown)
+    return context
+
+
+ANALYSIS_INSTRUCTIONS = """Please provide:
+
+1. **Critical Findings**: Identify any values that are significantly abnormal and require immediate attention (flagged H or L)
+
+2. **Key Observations**: Summarize the overall picture - what do these results tell us about the patient's condition?
+
+3. **Dialysis Adequacy Assessment**: Evaluate the KT/V and URR values (KT/V target: ≥1.2, URR target: ≥65%)
+
+4. **Clinical Recommendations**: 
+   - Monitoring suggestions
+   - Potential medication adjustments to consider
+   - Dietary recommendations
+   - Follow-up testing if needed
+
+5. **Nursing Considerations**: Practical points for dialysis unit nurses managing this patient
+
+Please be specific, practical, and prioritize patient safety. Use clear language suitable for healthcare professionals."""
+
+
+def build_analysis_prompt(context):
+    return f"""You are an experienced nephrology and dialysis nurse assistant. Analyze the following blood test results and provide clinical insights.
+
+{context}
+
+{ANALYSIS_INSTRUCTIONS}"""
+
+
+# --- Rolling Conversation Summary ---
+# Only the last `keep_recent` messages are sent verbatim. Older messages are
+# folded, once each, into a running summary: the nurse's question plus the
+# opening sentence and headings of each answer. When the summary outgrows its
+# budget the oldest points go first. No extra model call is needed.
+_sentence_end = re.compile(r"(?<=[.!?])\s")
+_heading = re.compile(r"\*\*([^*]{3,60})\*\*")
+
+
+def summarize_message(message, max_tokens=80):
+    text = " ".join(message["content"].split())
+    if message["role"] == "user":
+        return "Nurse asked: " + _truncate(text, max_tokens)
+    plain = re.sub(r"<[^>]+>|[#*_`]", "", text)
+    first = _sentence_end.split(plain, 1)[0]
+    headings = list(dict.fromkeys(h.strip(" :") for h in _heading.findall(text)))
+    point = "Assistant: " + first
+    if headings:
+        point += " Covered: " + "; ".join(headings[:6]) + "."
+    return _truncate(point, max_tokens)
+
+
+class ConversationMemory:
+    def __init__(self, keep_recent=2, summary_budget=SUMMARY_TOKEN_BUDGET, history_budget=HISTORY_TOKEN_BUDGET):
+        self.keep_recent = keep_recent
+        self.summary_budget = summary_budget
+        self.history_budget = history_budget
+        self.points = []
+        self.folded = 0  # messages of the history already in self.points
+
+    @property
+    def summary(self):
+        return "\n".join(f"- {p}" for p in self.points)
+
+    def fold(self, history):
+        # Summarize messages that just left the recent window; each is summarized once
+        end = max(0, len(history) - self.keep_recent)
+        for message in history[self.folded:end]:
+            self.points.append(summarize_message(message))
+        self.folded = max(self.folded, end)
+        while len(self.points) > 1 and estimate_tokens(self.summary) > self.summary_budget:
+            self.points.pop(0)
+
+    def forget(self, count):
+        # The first `count` messages were removed from the history (already folded)
+        self.folded = max(0, self.folded - count)
+
+    def build_followup_prompt(self, context, history, question):
+        # history: earlier messages, not including `question`
+        self.fold(history)
+        recent = history[-self.keep_recent:] if self.keep_recent else []
+        per_message = max(50, (self.history_budget - estimate_tokens(self.summary)) // max(1, len(recent)))
+
+        prompt = f"""
+You are an experienced nephrology and dialysis nurse assistant. Continue the conversation about this patient's blood test results.
+
+{context}
+"""
+        if self.points:
+            prompt += f"\nEarlier in this conversation:\n{self.summary}\n"
+        if recent:
+            prompt += "\nPrevious conversation:\n"
+            for msg in recent:
+                role = "Nurse" if msg["role"] == "user" else "Assistant"
+                prompt += f"\n{role}: {_truncate(msg['content'], per_message)}\n"
+        prompt += f"\nNurse: {question}\n\nAssistant:"
+        return prompt
@@ -0,0 +1,177 @@
+import math
+import threading
+import time
+
+# --- Token Bucket ---
+# Refills continuously at `rate` tokens/second up to `capacity`. Uses
+# time.monotonic(), so wall-clock changes never reset or stall the budget.
+# Not thread-safe on its own; GlobalRateLimiter holds the lock.
+class TokenBucket:
+    def __init__(self, capacity, rate, clock=time.monotonic):
+        self.capacity = capacity
+        self.rate = rate
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self):
+        self._refill()
+        return self.tokens
+
+    def consume(self, n=1):
+        # May go negative (debt) when a caller consumes without checking first
+        self._refill()
+        self.tokens -= n
+
+    def wait_time(self, n=1):
+        self._refill()
+        return max(0.0, (n - self.tokens) / self.rate)
+
+
+# --- Global Rate Limiter (one per server process) ---
+# Every session shares the single GOOGLE_API_KEY, so the quota is enforced by
+# one global bucket. Each session also gets its own smaller bucket (its fair
+# share), so a single busy tab cannot drain the key for everyone else. A
+# request needs a token from both. All checks are O(1).
+class GlobalRateLimiter:
+    def __init__(self, max_requests=15, time_window=60, session_max_requests=None, idle_session_ttl=600):
+        self.max_requests = max_requests
+        self.time_window = time_window
+        self.rate = max_requests / time_window
+        self.session_max_requests = session_max_requests or max(1, math.ceil(max_requests * 2 / 3))
+        self.idle_session_ttl = idle_session_ttl
+        self.rejections = 0
+        self._global = TokenBucket(max_requests, self.rate)
+        self._sessions = {}
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self._next_prune = time.monotonic() + idle_session_ttl
+
+    def _session(self, session_id):
+        now = time.monotonic()
+        if now >= self._next_prune:
+            self._prune(now)
+        bucket = self._sessions.get(session_id)
+        if bucket is None:
+            bucket = TokenBucket(self.session_max_requests, self.rate)
+            self._sessions[session_id] = bucket
+        return bucket
+
+    def _prune(self, now):
+        # Amortised: drop buckets of sessions idle for idle_session_ttl, at most once per ttl
+        cutoff = now - self.idle_session_ttl
+        for key in [k for k, b in self._sessions.items() if b.updated < cutoff]:
+            del self._sessions[key]
+        self._next_prune = now + self.idle_session_ttl
+
+    def _try_acquire(self, session_id):
+        bucket = self._session(session_id)
+        if self._global.available() >= 1 and bucket.available() >= 1:
+            self._global.consume()
+            bucket.consume()
+            return True
+        return False
+
+    def try_acquire(self, session_id):
+        with self._lock:
+            if self._try_acquire(session_id):
+                return True
+            self.rejections += 1
+            return False
+
+    # Waits up to `timeout` seconds in a queue for a token; returns False on timeout.
+    # Tokens are never handed back, they only refill with time, so a waiter
+    # sleeps (without the lock) until the refill it needs and checks again.
+    def acquire(self, session_id, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._waiting += 1
+        try:
+            while True:
+                with self._lock:
+                    if self._try_acquire(session_id):
+                        return True
+                    wait = self._wait_time(session_id, ahead=0)
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejections += 1
+                            return False
+                        wait = min(wait, remaining)
+                time.sleep(max(wait, 0.01))
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def add_request(self, session_id):
+        with self._lock:
+            self._global.consume()
+            self._session(session_id).consume()
+
+    def can_make_request(self, session_id):
+        return self.get_remaining_requests(session_id) > 0
+
+    def get_remaining_requests(self, session_id):
+        with self._lock:
+            return max(0, int(min(self._global.available(), self._session(session_id).available())))
+
+    def _wait_time(self, session_id, ahead):
+        return max(self._global.wait_time(1 + ahead), self._session(session_id).wait_time())
+
+    # Estimated seconds until this session can send, counting queued waiters ahead of it
+    def get_wait_time(self, session_id):
+        with self._lock:
+            return self._wait_time(session_id, ahead=self._waiting)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "global_available": int(self._global.available()),
+                "active_sessions": len(self._sessions),
+                "waiting": self._waiting,
+                "rejections": self.rejections,
+            }
+
+
+# --- Per-session view with the original RateLimiter interface ---
+class RateLimiter:
+    def __init__(self, limiter, session_id):
+        self.limiter = limiter
+        self.session_id = session_id
+        self.max_requests = limiter.session_max_requests
+        self.time_window = limiter.time_window
+
+    def can_make_request(self):
+        return self.limiter.can_make_request(self.session_id)
+
+    def try_acquire(self):
+        return self.limiter.try_acquire(self.session_id)
+
+    def acquire(self, timeout=None):
+        return self.limiter.acquire(self.session_id, timeout)
+
+    def add_request(self):
+        self.limiter.add_request(self.session_id)
+
+    def get_wait_time(self):
+        return self.limiter.get_wait_time(self.session_id)
+
+    def get_remaining_requests(self):
+        return self.limiter.get_remaining_requests(self.session_id)
+
+    # charge(attempt) for HedgedDispatcher: the first model call may queue up to
+    # queue_seconds for quota (raises if none frees up); hedged backups only
+    # launch if a slot is free right now
+    def charger(self, queue_seconds):
+        def charge(attempt):
+            if attempt > 0:
+                return self.try_acquire()
+            if not self.acquire(timeout=queue_seconds):
+                raise Exception(f"Rate limit reached. Please wait {int(self.get_wait_time())} seconds.")
+            return True
+        return charge
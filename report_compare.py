@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+from lab_parser import items_info
+from lab_results import TEST_INDEX, lab_table
+from adequacy import adequacy_arrays
+
+# --- Side-by-side Report Comparison ---
+# One column per report (oldest first), one row per test. Every report is
+# converted and flagged in one lab_table call, and KT/V & URR for all reports
+# come from one adequacy_arrays call.
+
+ADEQUACY_ROWS = ["URR (%)", "KT/V"]
+
+
+def report_labels(reports, names):
+    # Report date per column, file name when the date is missing; repeats get a counter
+    labels, seen = [], {}
+    for report, name in zip(reports, names):
+        label = report.report_date or name
+        seen[label] = seen.get(label, 0) + 1
+        labels.append(label if seen[label] == 1 else f"{label} ({seen[label]})")
+    return labels
+
+
+def sort_reports(reports, names):
+    # Oldest first; undated reports keep their upload order after the dated ones
+    order = sorted(range(len(reports)), key=lambda i: (not reports[i].report_date, reports[i].report_date, i))
+    return [reports[i] for i in order], [names[i] for i in order]
+
+
+def comparison_table(reports, labels, dialysis_time, uf_volume, post_weight, tests=None, age=0, sex=""):
+    # Returns (table, abnormal): the wide table of values (in the items_info
+    # units, NaN when not found) with a "Δ" column (latest minus previous) when
+    # there are two or more reports, and a boolean frame of the same shape
+    # marking out-of-range cells. age / sex select the reference ranges.
+    tests = list(tests or items_info)
+    lab = lab_table([report.results for report in reports], age, sex)
+    columns = [TEST_INDEX[test] for test in tests]
+    numeric = lab.value[:, columns].T
+    abnormal = lab.abnormal[:, columns].T
+
+    URR, kt_v = adequacy_arrays(lab.column("Urea"), lab.column("Urea - Post Dialysis"), dialysis_time, uf_volume, post_weight)
+    numeric = np.vstack([numeric, URR.filled(np.nan), kt_v.filled(np.nan)])
+    abnormal = np.vstack([abnormal, np.zeros((len(ADEQUACY_ROWS), len(reports)), dtype=bool)])
+    table = pd.DataFrame(numeric, index=pd.Index(tests + ADEQUACY_ROWS, name="Test"), columns=labels)
+
+    abnormal = pd.DataFrame(abnormal, index=table.index, columns=table.columns)
+    if len(labels) > 1:
+        delta = np.round(numeric[:, -1] - numeric[:, -2], 2)
+        table["Δ"] = ["" if np.isnan(d) else f"{d:+g}" for d in delta]
+        abnormal["Δ"] = False
+    return table, abnormal
+
+
+def serology_table(reports, labels):
+    tests = list(dict.fromkeys(test for report in reports for test in (report.serology or {})))
+    columns = {
+        label: [(report.serology or {}).get(test, "Not done") for test in tests]
+        for label, report in zip(labels, reports)
+    }
+    return pd.DataFrame(columns, index=pd.Index(tests, name="Test"))
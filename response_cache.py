@@ -0,0 +1,109 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Analyses describe patients, so the disk tier is opt-in: set AI_RESPONSE_CACHE
+# to a file path (e.g. .cache/ai_responses.sqlite3) to keep them across restarts
+DEFAULT_CACHE_PATH = os.environ.get("AI_RESPONSE_CACHE", "")
+
+
+# --- AI Response Cache ---
+# Two tiers: an in-memory LRU for the hot set and, when a path is given, a
+# SQLite file that survives restarts. Entries expire after `ttl` seconds; the disk tier is trimmed to
+# `disk_entries` rows by last access. Identical analysis requests are served
+# from here without a Gemini call or a rate-limit slot.
+class ResponseCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, memory_entries=128, disk_entries=5000, ttl=7 * 24 * 3600):
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl = ttl
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, created_at REAL, accessed_at REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+
+    @staticmethod
+    def make_key(prompt, version=""):
+        # Whitespace-insensitive, so reformatting the same context still hits.
+        # Not keyed on the model: the resolver's choice can change between the
+        # lookup and the store; `version` (e.g. PARSER_VERSION) retires old entries.
+        normalized = "\n".join(" ".join(line.split()) for line in prompt.strip().splitlines() if line.strip())
+        return hashlib.sha256(f"{version}\n{normalized}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, expires_at, response):
+        self._memory[key] = (expires_at, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and entry[0] > now:
+                self._memory.move_to_end(key)
+                self.hits["memory"] += 1
+                return entry[1]
+            if entry:
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row and row[1] + self.ttl > now:
+                    self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._remember(key, row[1] + self.ttl, row[0])
+                    self.hits["disk"] += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, model_name, response):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now + self.ttl, response)
+            if self._db is None:
+                return
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, response, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, model_name, response, now, now),
+                )
+                self._db.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+                self._db.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.disk_entries,),
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                # Leaves the connection usable for the next put
+                self._db.execute("ROLLBACK")
+                raise
+
+    def stats(self):
+        with self._lock:
+            disk_size = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] if self._db is not None else 0
+            return {
+                "memory_hits": self.hits["memory"],
+                "disk_hits": self.hits["disk"],
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_size,
+            }
@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import threading
+from datetime import date, timedelta
+
+# Default location; override with RESULT_STORE_PATH
+DEFAULT_STORE_PATH = os.environ.get("RESULT_STORE_PATH", os.path.join(".cache", "lab_history.sqlite3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    report_id INTEGER PRIMARY KEY,
+    file_sha256 TEXT NOT NULL UNIQUE,
+    patient_id TEXT NOT NULL,
+    patient_name TEXT,
+    report_date TEXT NOT NULL,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS lab_results (
+    report_id INTEGER NOT NULL REFERENCES reports (report_id) ON DELETE CASCADE,
+    patient_id TEXT NOT NULL,
+    test TEXT NOT NULL,
+    report_date TEXT NOT NULL,
+    value REAL,
+    value_text TEXT,
+    abnormal INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS serology (
+    report_id INTEGER NOT NULL REFERENCES reports (report_id) ON DELETE CASCADE,
+    patient_id TEXT NOT NULL,
+    test TEXT NOT NULL,
+    report_date TEXT NOT NULL,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_lab_patient_test_date ON lab_results (patient_id, test, report_date);
+CREATE INDEX IF NOT EXISTS idx_serology_patient_test_date ON serology (patient_id, test, report_date);
+CREATE INDEX IF NOT EXISTS idx_reports_patient_date ON reports (patient_id, report_date);
+"""
+
+
+# --- Longitudinal Result Store ---
+# One SQLite file with every saved report, keyed by the extracted patient ID.
+# Lab rows carry (patient_id, test, report_date) and are indexed on exactly
+# that, so a patient's trend for a handful of tests is an index range scan.
+# Reports are de-duplicated by file hash; a file stored again under another
+# patient ID is moved to that ID. Bulk loads run in one transaction.
+class ResultStore:
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _insert(self, report):
+        # report: file_sha256, patient_id, patient_name, report_date,
+        # results (LabTable.records(converted_only=True) rows, all in canonical units),
+        # serology ({test: result}), optional urr / kt_v and source
+        patient_id, report_date = report["patient_id"], report["report_date"]
+        stored = self._db.execute(
+            "SELECT report_id, patient_id FROM reports WHERE file_sha256 = ?", (report["file_sha256"],)
+        ).fetchone()
+        if stored is not None:
+            report_id, stored_patient_id = stored
+            if stored_patient_id == patient_id:
+                return None
+            # Same file, corrected patient ID: re-file it rather than keep the old one
+            self._db.execute(
+                "UPDATE reports SET patient_id = ?, patient_name = ? WHERE report_id = ?",
+                (patient_id, report.get("patient_name", ""), report_id),
+            )
+            for table in ("lab_results", "serology"):
+                self._db.execute(f"UPDATE {table} SET patient_id = ? WHERE report_id = ?", (patient_id, report_id))
+            return report_id
+
+        report_id = self._db.execute(
+            "INSERT INTO reports (file_sha256, patient_id, patient_name, report_date, source) VALUES (?, ?, ?, ?, ?)",
+            (report["file_sha256"], patient_id, report.get("patient_name", ""), report_date, report.get("source", "")),
+        ).lastrowid
+
+        lab_rows = []
+        for test, value, unit, _, flag in report.get("results", []):
+            lab_rows.append((report_id, patient_id, test, report_date, value, f"{round(value, 2):g} {unit}", int(bool(flag))))
+        for test, key in (("URR (%)", "urr"), ("KT/V", "kt_v")):
+            if report.get(key) is not None:
+                lab_rows.append((report_id, patient_id, test, report_date, float(report[key]), str(report[key]), 0))
+        self._db.executemany("INSERT INTO lab_results VALUES (?, ?, ?, ?, ?, ?, ?)", lab_rows)
+        self._db.executemany(
+            "INSERT INTO serology VALUES (?, ?, ?, ?, ?)",
+            [(report_id, patient_id, test, report_date, result) for test, result in (report.get("serology") or {}).items()],
+        )
+        return report_id
+
+    def add_reports(self, reports):
+        # Returns the number of new or re-filed reports; files already stored
+        # under the same patient ID are skipped
+        added = 0
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                for report in reports:
+                    if self._insert(report) is not None:
+                        added += 1
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return added
+
+    def add_report(self, report):
+        return self.add_reports([report]) == 1
+
+    def history(self, patient_id, tests=None, months=12, until=None):
+        # [(report_date, test, value, abnormal)] for the last `months` months, oldest first;
+        # tests=None means every test, an empty list none
+        if tests is not None and not tests:
+            return []
+        until = until or date.today().isoformat()
+        since = (date.fromisoformat(until) - timedelta(days=round(months * 30.44))).isoformat()
+        query = "SELECT report_date, test, value, abnormal FROM lab_results WHERE patient_id = ?"
+        params = [patient_id]
+        if tests is not None:
+            query += f" AND test IN ({', '.join('?' for _ in tests)})"
+            params += list(tests)
+        query += " AND report_date BETWEEN ? AND ? ORDER BY report_date"
+        params += [since, until]
+        with self._lock:
+            return self._db.execute(query, params).fetchall()
+
+    def report_count(self, patient_id):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM reports WHERE patient_id = ?", (patient_id,)).fetchone()[0]
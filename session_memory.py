@@ -0,0 +1,119 @@
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from dataclasses import fields, is_dataclass
+from types import MappingProxyType
+
+# Chat messages kept verbatim per session; older ones are archived compressed
+MAX_CHAT_MESSAGES = 20
+
+
+# --- Bounded Chat History ---
+# Moves all but the newest `max_messages` messages into `archive` as one
+# zlib-compressed JSON blob per trim. They were already folded into the
+# prompt's rolling summary, so follow-up prompts do not change.
+def trim_chat_history(history, archive, memory=None, max_messages=MAX_CHAT_MESSAGES):
+    overflow = len(history) - max_messages
+    if overflow <= 0:
+        return 0
+    if memory is not None:
+        memory.fold(history)
+        memory.forget(overflow)
+    archive.append(zlib.compress(json.dumps(history[:overflow]).encode("utf-8")))
+    del history[:overflow]
+    return overflow
+
+
+def load_archive(archive):
+    return [message for blob in archive for message in json.loads(zlib.decompress(blob))]
+
+
+# --- Memory Accounting ---
+def approx_size(obj, _seen=None):
+    # Deep sys.getsizeof over the containers the app keeps in session state
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (dict, MappingProxyType)):
+        size += sum(approx_size(k, seen) + approx_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_size(item, seen) for item in obj)
+    elif is_dataclass(obj) and not isinstance(obj, type):
+        size += sum(approx_size(getattr(obj, f.name), seen) for f in fields(obj))
+    return size
+
+
+def process_rss():
+    # Resident memory of this process in bytes (peak where current is unavailable), or None
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# --- Per-session Artifacts (one registry per server process) ---
+# Parsed reports and upload sources live here instead of in st.session_state,
+# keyed by session ID, so they can be dropped for sessions idle longer than
+# `idle_ttl` (a returning session simply re-parses through the parse cache).
+# Eviction is amortised: at most one sweep per `sweep_interval` seconds.
+class SessionArtifacts:
+    def __init__(self, idle_ttl=1800, sweep_interval=60):
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self.evicted = 0
+        self._sessions = {}  # session_id -> [last seen, {key: value}]
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    def touch(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            self._sessions.setdefault(session_id, [now, {}])[0] = now
+            if now >= self._next_sweep:
+                self._sweep(now)
+
+    def get(self, session_id, key, default=None):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            return entry[1].get(key, default) if entry else default
+
+    def put(self, session_id, key, value):
+        with self._lock:
+            self._sessions.setdefault(session_id, [time.monotonic(), {}])[1][key] = value
+
+    def pop(self, session_id, key, default=None):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            return entry[1].pop(key, default) if entry else default
+
+    def _sweep(self, now):
+        cutoff = now - self.idle_ttl
+        for session_id in [s for s, (seen, _) in self._sessions.items() if seen < cutoff]:
+            del self._sessions[session_id]
+            self.evicted += 1
+        self._next_sweep = now + self.sweep_interval
+
+    def session_bytes(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            return approx_size(entry[1]) if entry else 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "artifact_bytes": approx_size({s: items for s, (_, items) in self._sessions.items()}),
+                "evicted": self.evicted,
+            }
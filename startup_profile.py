@@ -0,0 +1,138 @@
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+
+# Cold-start profile: what app.py pays for before its first paint.
+#
+#   python startup_profile.py                 # import-time breakdown
+#   python startup_profile.py --first-paint   # also time a headless first run of app.py
+#   python startup_profile.py --json startup.json --max-ms 1500
+#
+# Every measurement runs in a fresh interpreter, so nothing is already imported.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def app_imports(path=os.path.join(HERE, "app.py")):
+    # Read from app.py itself, so the lists cannot drift from it. Returns
+    # (non-stdlib modules imported at module level, in import order; the repo's
+    # own modules imported inside blocks, i.e. on the first report or AI request)
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+
+    def names(node):
+        if isinstance(node, ast.Import):
+            return [alias.name for alias in node.names]
+        if isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            return [node.module]
+        return []
+
+    startup = [name for node in tree.body for name in names(node)]
+    later = [name for node in ast.walk(tree) if node not in tree.body for name in names(node)]
+    startup = [name for name in dict.fromkeys(startup) if name.split(".")[0] not in sys.stdlib_module_names]
+    local = [name for name in dict.fromkeys(later) if os.path.exists(os.path.join(HERE, name.split(".")[0] + ".py"))]
+    return startup, [name for name in local if name not in startup]
+
+
+APP_MODULES, LAZY_APP_MODULES = app_imports()
+
+# Must stay out of the first paint; loaded on the first report or AI request
+DEFERRED_MODULES = ["google.generativeai", "pandas", "fitz"] + LAZY_APP_MODULES
+
+FIRST_PAINT_CODE = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+preloaded = {m: m in sys.modules for m in DEFERRED}
+start = time.perf_counter()
+at = AppTest.from_file("app.py", default_timeout=120).run()
+seconds = time.perf_counter() - start
+print(json.dumps({
+    "seconds": seconds,
+    "exceptions": [str(e.value) for e in at.exception],
+    "loaded": {m: m in sys.modules and not preloaded[m] for m in DEFERRED},
+    "preloaded": preloaded,
+}))
+"""
+
+
+def _run(code, *flags):
+    return subprocess.run([sys.executable, *flags, "-c", code], cwd=HERE, capture_output=True, text=True)
+
+
+# --- 导入时间 ---
+# Parses `python -X importtime` output: one line per module with self and
+# cumulative microseconds, nesting shown by indentation. Returns the top-level
+# imports (one per app module) with their heaviest direct dependencies.
+def import_breakdown(modules=APP_MODULES, children=3):
+    proc = _run("; ".join(f"import {m}" for m in modules), "-X", "importtime")
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((depth, name.strip(), int(cumulative) / 1000))
+
+    # A module's children are printed before it, at depth + 1
+    rows = []
+    pending = []
+    for depth, name, ms in entries:
+        if depth == 0:
+            top = sorted((c for c in pending if c[0] == 1), key=lambda c: -c[2])[:children]
+            rows.append({"module": name, "ms": round(ms, 1), "heaviest": [{"module": n, "ms": round(m, 1)} for _, n, m in top]})
+            pending = []
+        else:
+            pending.append((depth, name, ms))
+    return [row for row in rows if row["module"].split(".")[0] in {m.split(".")[0] for m in modules}]
+
+
+def first_paint():
+    proc = _run(f"DEFERRED = {DEFERRED_MODULES!r}\n" + FIRST_PAINT_CODE)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "app run failed")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print the app's import-time breakdown and, optionally, its first-paint time.")
+    parser.add_argument("--first-paint", action="store_true", help="Also run app.py once headless (streamlit AppTest) and time it")
+    parser.add_argument("--json", help="Write the results to this JSON file")
+    parser.add_argument("--max-ms", type=float, help="Exit with status 1 if total import time (or first paint) exceeds this many ms")
+    args = parser.parse_args(argv)
+
+    rows = import_breakdown()
+    total = sum(row["ms"] for row in rows)
+    print(f"{'module':<24}{'ms':>10}  heaviest imports")
+    for row in sorted(rows, key=lambda r: -r["ms"]):
+        heaviest = ", ".join(f"{c['module']} {c['ms']:.0f}" for c in row["heaviest"])
+        print(f"{row['module']:<24}{row['ms']:>10.1f}  {heaviest}")
+    print(f"{'total':<24}{total:>10.1f}")
+    result = {"imports": rows, "import_ms": round(total, 1)}
+
+    failed = args.max_ms is not None and total > args.max_ms
+    if args.first_paint:
+        paint = first_paint()
+        result["first_paint"] = paint
+        print(f"\n🎨 First paint (headless run of app.py): {paint['seconds'] * 1000:.0f} ms")
+        for module, loaded in paint["loaded"].items():
+            note = "preloaded by Streamlit" if paint["preloaded"][module] else ("❌ loaded" if loaded else "✅ deferred")
+            print(f"   {module}: {note}")
+        for error in paint["exceptions"]:
+            print(f"   ⚠️ {error}")
+        failed = failed or (args.max_ms is not None and paint["seconds"] * 1000 > args.max_ms)
+        failed = failed or any(paint["loaded"].values())
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())